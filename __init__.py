@@ -4,5 +4,8 @@ __VERSION__ = __version__
 from .workbook import XlWorkbook
 from .worksheet import XlWorksheet
 from .style import Style
-from .stylesheet import StyleSheet
+from .stylesheet import StyleSheet, CompiledStyleSheet
 from .row import Row
+from .block import Block
+from .stats import BuildStats
+from .snapshot import WorkbookSnapshot
@@ -0,0 +1,188 @@
+import logging
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from time import perf_counter
+from .workbook import XlWorkbook
+from .worksheet import XlWorksheet
+from .stylesheet import StyleSheet, CompiledStyleSheet
+
+log = logging.getLogger(__name__)
+
+# One report of a batch. error is None or the formatted traceback.
+JobResult = namedtuple(
+    'JobResult', 'index, filename, params, seconds, bytes, stats, error'
+)
+
+# The compiled stylesheet a worker process builds every report with.
+_stylesheet = None
+
+
+def _init_worker(stylesheet):
+    global _stylesheet
+    _stylesheet = stylesheet
+
+
+def run_job(report, index, filename, params, workbook_class=XlWorkbook,
+            options=None, properties=None, stylesheet=None):
+    """Build one report and return its JobResult, catching any error.
+
+    A report that fails is discarded: its workbook's temporary files and
+    any output already written are deleted.
+
+    report is called as report(workbook, **params), or, for an
+    XlWorksheet subclass, created as a sheet of the workbook with params
+    as keyword arguments.
+    """
+    start = perf_counter()
+    wb = None
+    error = None
+    built = False
+    try:
+        wb = workbook_class(
+            filename, options, properties,
+            stylesheet=stylesheet or _stylesheet,
+        )
+        if isinstance(report, type) and issubclass(report, XlWorksheet):
+            report(stylesheet=wb.css, workbook=wb, **params)
+        else:
+            report(wb, **params)
+        wb.build(quiet=True)
+        built = True
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        # A failed report leaves no temporary files or partial output.
+        if wb is not None and not built:
+            wb.discard()
+    stats = wb.stats if wb is not None else None
+    size = stats.counts.get((None, 'bytes'), 0) if stats else 0
+    return JobResult(
+        index, filename, params, perf_counter() - start, size, stats, error,
+    )
+
+
+class BatchSummary(object):
+    """Results of run_batch(), one JobResult per job in job order."""
+
+    def __init__(self, results, seconds):
+        self.results = sorted(results, key=lambda result: result.index)
+        self.seconds = seconds  # wall time of the whole batch
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.error is None]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if result.error is not None]
+
+    def as_dict(self):
+        times = [result.seconds for result in self.results]
+        return {
+            'jobs': len(self.results),
+            'succeeded': len(self.succeeded),
+            'failed': len(self.failed),
+            'seconds': self.seconds,
+            'job_seconds': sum(times),
+            'slowest': max(times, default=0.0),
+            'bytes': sum(result.bytes for result in self.results),
+        }
+
+    def __str__(self):
+        summary = self.as_dict()
+        return (
+            f"{summary['succeeded']} of {summary['jobs']} reports built in "
+            f"{summary['seconds']:.2f}s, {summary['failed']} failed"
+        )
+
+
+def run_batch(
+    report,
+    jobs,
+    filename=None,
+    stylesheet=None,
+    workers=None,
+    max_pending=None,
+    workbook_class=XlWorkbook,
+    options=None,
+    properties=None,
+):
+    """Build one workbook per parameter set in jobs.
+
+    jobs is an iterable of dicts, read only as fast as workers free up.
+    filename is a format string filled with each job's params, a
+    function of the params, or None to take each job's 'filename' item.
+    stylesheet (a StyleSheet or CompiledStyleSheet) is compiled once and
+    every workbook gets a fresh copy of its styles.
+
+    With more than one worker, jobs run in a process pool with at most
+    max_pending (default twice the workers) submitted at a time; with
+    one they run in this process. A job that raises is recorded in the
+    summary and the batch carries on. Returns a BatchSummary.
+    """
+    if isinstance(stylesheet, StyleSheet):
+        stylesheet = stylesheet.compile()
+    elif stylesheet is not None and \
+            not isinstance(stylesheet, CompiledStyleSheet):
+        raise TypeError(
+            "Pass a saved stylesheet as CompiledStyleSheet.load(path)."
+        )
+    workers = workers or 1
+    max_pending = max_pending or 2 * workers
+    start = perf_counter()
+    results = []
+
+    def job_args(index, params):
+        params = dict(params)
+        if filename is None:
+            name = params.pop('filename')
+        elif callable(filename):
+            name = filename(params)
+        else:
+            name = filename.format(**params)
+        return (report, index, name, params, workbook_class, options,
+                properties)
+
+    def done(result):
+        results.append(result)
+        if result.error is not None:
+            log.warning("Report %s failed:\n%s", result.filename,
+                        result.error)
+
+    if workers == 1:
+        for index, params in enumerate(jobs):
+            done(run_job(*job_args(index, params), stylesheet=stylesheet))
+        return BatchSummary(results, perf_counter() - start)
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker,
+        initargs=(stylesheet,),
+    ) as pool:
+        pending = {}
+        for index, params in enumerate(jobs):
+            if len(pending) >= max_pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    _collect(future, pending.pop(future), done)
+            args = job_args(index, params)
+            pending[pool.submit(run_job, *args)] = args
+        for future in list(pending):
+            _collect(future, pending.pop(future), done)
+    return BatchSummary(results, perf_counter() - start)
+
+
+def _collect(future, args, done):
+    # Errors inside a report are caught by run_job; this catches jobs
+    # that could not be sent to a worker or whose worker died.
+    try:
+        result = future.result()
+    except Exception:
+        _, index, name, params = args[:4]
+        result = JobResult(
+            index, name, params, 0.0, 0, None, traceback.format_exc(),
+        )
+    done(result)
@@ -0,0 +1,204 @@
+"""Benchmarks for the xlmaker build pipeline.
+
+Each workload builds a synthetic workbook shaped like a real report and
+records wall time, peak traced allocations and the size of the file
+written. Results can be saved as a baseline and later runs compared
+against it:
+
+    python -m xlmaker.benchmarks.bench --save baseline.json
+    python -m xlmaker.benchmarks.bench --baseline baseline.json --threshold 20
+
+The comparison exits with status 1 if any metric is worse than the
+baseline by more than the threshold percentage.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from xlmaker import XlWorkbook, StyleSheet
+
+METRICS = ('time', 'peak_kib', 'size')
+
+
+def wide_numeric(path, scale=1.0):
+    """A wide table of numbers written one cell at a time."""
+    rows, cols = int(5000 * scale), 40
+    wb = XlWorkbook(filename=path)
+    ws = wb.add_worksheet('numbers')
+    css = wb.css
+    for r in range(rows):
+        for c in range(cols):
+            ws.number(r * cols + c, css.number)
+        ws.next_row()
+    return wb
+
+
+def overlapped_styles(path, scale=1.0):
+    """Banded ranges, boxes and cell styles layered over each other."""
+    rows, cols = int(2000 * scale), 20
+    wb = XlWorkbook(filename=path)
+    ws = wb.add_worksheet('styles')
+    css = wb.css
+    for r in range(0, rows, 2):
+        ws.format_range(r, 0, r, cols - 1, css.spacer)
+    for c in range(0, cols, 5):
+        ws.format_range(0, c, rows - 1, c, css.bold)
+    for r in range(0, rows, 50):
+        ws.box(r, 0, r + 9, cols - 1)
+    for r in range(rows):
+        for c in range(cols):
+            ws.cell(r + c, [('percent', 'currency')[c % 2], 'under'])
+        ws.next_row()
+    return wb
+
+
+def many_sheets(path, scale=1.0):
+    """A board pack: many small sheets with headers and totals."""
+    sheets, rows, cols = 40, int(200 * scale), 12
+    wb = XlWorkbook(filename=path)
+    css = wb.css
+    for s in range(sheets):
+        ws = wb.add_worksheet(f'sheet{s}')
+        ws.cell('Heading', ['bold', 'under'])
+        ws.next_row(2)
+        for c in range(cols):
+            ws.string(f'col{c}', css.centered)
+        ws.next_row()
+        for r in range(rows):
+            for c in range(cols):
+                ws.number(r + c, css.number)
+            ws.next_row()
+    return wb
+
+
+def formula_totals(path, scale=1.0):
+    """Numbers with a vtotal row and an htotal column on every block."""
+    blocks, rows, cols = int(100 * scale), 30, 10
+    wb = XlWorkbook(filename=path)
+    ws = wb.add_worksheet('totals')
+    css = wb.css
+    for b in range(blocks):
+        for r in range(rows):
+            for c in range(cols):
+                ws.number(r * c, css.number)
+            ws.htotal(cols, css.number)
+            ws.next_row()
+        for c in range(cols + 1):
+            ws.vtotal(rows, css.total, col=c)
+        ws.next_row(2)
+    return wb
+
+
+def combine_styles(path, scale=1.0):
+    """StyleSheet.combine_styles() over many style lists."""
+    css = StyleSheet()
+    names = ['bold', 'under', 'centered', 'percent', 'currency', 'wrap']
+    for i in range(int(200000 * scale)):
+        css.combine_styles([names[i % 6], names[(i // 6) % 6]])
+    wb = XlWorkbook(filename=path, stylesheet=css)
+    wb.add_worksheet('empty')
+    return wb
+
+
+WORKLOADS = {
+    'wide_numeric': wide_numeric,
+    'overlapped_styles': overlapped_styles,
+    'many_sheets': many_sheets,
+    'formula_totals': formula_totals,
+    'combine_styles': combine_styles,
+}
+
+
+def _quiet_build(wb):
+    wb.build(quiet=True)
+
+
+def run_workload(workload, scale=1.0, repeat=1):
+    """Build a workload and return its metrics.
+
+    time is the best of repeat untraced runs; peak_kib comes from a
+    separate run under tracemalloc.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.xlsx')
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            _quiet_build(workload(path, scale))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        size = os.path.getsize(path)
+        tracemalloc.start()
+        try:
+            _quiet_build(workload(path, scale))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'time': best, 'peak_kib': peak / 1024, 'size': size}
+
+
+def run(names=None, scale=1.0, repeat=1):
+    names = names or list(WORKLOADS)
+    return {
+        name: run_workload(WORKLOADS[name], scale, repeat) for name in names
+    }
+
+
+def compare(results, baseline, threshold=10.0):
+    """Metrics worse than baseline by more than threshold percent.
+
+    Returns a list of (workload, metric, baseline, result) tuples.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in METRICS:
+            if metric not in base or not base[metric]:
+                continue
+            if metrics[metric] > base[metric] * (1 + threshold / 100):
+                regressions.append((name, metric, base[metric], metrics[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('workloads', nargs='*',
+        help='workloads to run: ' + ', '.join(WORKLOADS))
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=10.0,
+        help='allowed regression in percent')
+    parser.add_argument('--save', help='write the results to this file')
+    args = parser.parse_args(argv)
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error('unknown workloads: ' + ', '.join(sorted(unknown)))
+
+    results = run(args.workloads, args.scale, args.repeat)
+    for name, metrics in results.items():
+        print(
+            f"{name: <20} {metrics['time']:8.3f}s "
+            f"{metrics['peak_kib']:12.0f} KiB {metrics['size']:10d} bytes"
+        )
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, base, result in regressions:
+            print(f"REGRESSION {name}.{metric}: {base:.3f} -> {result:.3f}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+from itertools import islice, zip_longest
+
+
+class Block(object):
+    """A rectangular range of values stored column by column.
+
+    Each column keeps the sequence it was given (a list, a NumPy array
+    column or a memoryview) along with a single style and data_type, so no
+    per-value objects are created until the block is written.
+    """
+    _compiled = None
+    _owned = None  # indices of the columns copied to be changed
+    _rule_masks = None  # col: [(row mask, style)] of build time rule hits
+    order = 0  # when it was added among the sheet's overlays and blocks
+
+    def __init__(self, row, col, columns, styles, data_types):
+        self.row = row
+        self.col = col
+        self.columns = columns
+        self.styles = styles
+        self.data_types = data_types
+        self.num_rows = max((len(c) for c in columns), default=0)
+        self.num_cols = len(columns)
+
+    def __len__(self):
+        return self.num_rows * self.num_cols
+
+    def __getstate__(self):
+        # memoryviews can't be pickled, so copy them out.
+        state = self.__dict__.copy()
+        state['columns'] = [
+            c.tolist() if isinstance(c, memoryview) else c
+            for c in self.columns
+        ]
+        state.pop('_compiled', None)
+        return state
+
+    def __lt__(self, other):
+        return ((self.row, self.col) < (other.row, other.col))
+
+    @property
+    def last_row(self):
+        return self.row + self.num_rows - 1
+
+    @property
+    def last_col(self):
+        return self.col + self.num_cols - 1
+
+    def covers(self, row, col):
+        return (
+            self.row <= row <= self.last_row and
+            self.col <= col <= self.last_col
+        )
+
+    def get_value(self, row, col):
+        column = self.columns[col - self.col]
+        i = row - self.row
+        return column[i] if i < len(column) else None
+
+    def writable_column(self, col):
+        """The values of col as a list this block owns.
+
+        A column is copied the first time it is changed, so a list or
+        array the caller passed in is never written to.
+        """
+        j = col - self.col
+        if self._owned is None:
+            self._owned = set()
+        if j not in self._owned:
+            column = self.columns[j]
+            self.columns[j] = (
+                column.tolist() if hasattr(column, "tolist") else list(column)
+            )
+            self._owned.add(j)
+        return self.columns[j]
+
+    def get_style(self, col):
+        return self.styles[col - self.col]
+
+    def get_type(self, col):
+        return self.data_types[col - self.col]
+
+    def add_rule_hits(self, col, rows, style):
+        """Extend the style of rows of a column with a rule's style.
+
+        The rows are kept as a mask of one byte per row of the block, so
+        no cell is stored for them.
+        """
+        mask = bytearray(self.num_rows)
+        for row in rows:
+            mask[row - self.row] = 1
+        if self._rule_masks is None:
+            self._rule_masks = {}
+        self._rule_masks.setdefault(col, []).append((mask, style))
+
+    def rule_styles(self, row):
+        """Columns of row with rule hits, and the styles of the rules
+        they passed in the order applied."""
+        if not self._rule_masks:
+            return {}
+        i = row - self.row
+        result = {}
+        for col, masks in self._rule_masks.items():
+            styles = [style for mask, style in masks if mask[i]]
+            if styles:
+                result[col] = styles
+        return result
+
+    def compile(self, sheet):
+        """The writer and format of each column, looked up once per sheet."""
+        if self._compiled is None or self._compiled[0] is not sheet:
+            self._compiled = (
+                sheet,
+                [sheet.cell_writer(t) for t in self.data_types],
+                [s.format if s is not None else None for s in self.styles],
+            )
+        return self._compiled
+
+    def write_row(self, sheet, row, skip=None, formats=None):
+        """Write one row of the block, skipping any columns in skip.
+
+        formats maps columns to formats that replace the column's own.
+        """
+        i = row - self.row
+        col = self.col
+        _, writers, column_formats = self.compile(sheet)
+        blank = sheet._write_blank
+        trusted = sheet.trusted_types
+        for column, write, fmt in zip(self.columns, writers, column_formats):
+            if (skip is None or col not in skip) and i < len(column):
+                if formats and col in formats:
+                    fmt = formats[col]
+                value = column[i]
+                if value is None or (not trusted and value == ''):
+                    blank(row, col, '', fmt)
+                else:
+                    write(row, col, value, fmt)
+            col += 1
+
+
+def to_columns(values, orient="rows"):
+    """Split a 2-D input into a list of column sequences.
+
+    NumPy arrays are sliced into column views and buffer-protocol objects
+    into strided memoryviews, so neither is copied.
+    """
+    if orient not in ("rows", "columns"):
+        raise ValueError(f"orient must be 'rows' or 'columns', not {orient}")
+    if hasattr(values, "ndim") and not isinstance(values, memoryview):
+        if values.ndim == 1:
+            return [values]
+        if values.ndim != 2:
+            raise ValueError("Only 1-D and 2-D arrays can be written.")
+        if orient == "columns":
+            return [values[j] for j in range(values.shape[0])]
+        return [values[:, j] for j in range(values.shape[1])]
+    if not isinstance(values, (str, bytes, bytearray)):
+        try:
+            view = memoryview(values)
+        except TypeError:
+            view = None
+        if view is not None:
+            return _buffer_columns(view, orient)
+    if orient == "columns":
+        return [
+            c if hasattr(c, "__len__") and hasattr(c, "__getitem__")
+            else list(c)
+            for c in values
+        ]
+    return [list(c) for c in zip_longest(*values)]
+
+
+def iter_batches(rows, size):
+    """Lists of up to size rows from a DB-API cursor or an iterable.
+
+    A cursor is read with fetchmany(), anything else with islice(), so
+    only one batch is held at a time.
+    """
+    fetchmany = getattr(rows, "fetchmany", None)
+    if fetchmany is None:
+        rows = iter(rows)
+        fetchmany = lambda size: list(islice(rows, size))
+    while True:
+        batch = fetchmany(size)
+        if not batch:
+            return
+        yield batch
+
+
+def _buffer_columns(view, orient):
+    if view.ndim <= 1:
+        return [view]
+    if view.ndim != 2:
+        raise ValueError("Only 1-D and 2-D buffers can be written.")
+    num_rows, num_cols = view.shape
+    flat = view.cast("B").cast(view.format)
+    if orient == "columns":
+        return [flat[j * num_cols:(j + 1) * num_cols] for j in range(num_rows)]
+    return [flat[j::num_cols] for j in range(num_cols)]
+
+
+def infer_data_type(column):
+    """Pick a data_type for a column from its buffer type, if it has one."""
+    dtype = getattr(column, "dtype", None)
+    if dtype is not None:
+        return "number" if dtype.kind in "iuf" else None
+    if isinstance(column, memoryview):
+        return None if column.format in ("?", "c") else "number"
+    return None
+
+
+def per_column(option, num_cols, name):
+    """Expand a single option to every column, or check a per-column list."""
+    if isinstance(option, list):
+        if len(option) != num_cols:
+            raise ValueError(
+                f"Expected {num_cols} {name}, got {len(option)}."
+            )
+        return option
+    return [option] * num_cols
@@ -1,22 +1,73 @@
+import datetime
+import logging
+
+log = logging.getLogger(__name__)
+
+# The xlsxwriter method that writes each data_type without inspecting the
+# value.
+WRITERS = {
+    'number': '_write_number',
+    'str': '_write_string',
+    'datetime': '_write_datetime',
+    'formula': '_write_formula',
+    'url': '_write_url',
+    'bool': '_write_boolean',
+}
+
+# The data_type trusted cells without one are written as, by Python type.
+TRUSTED_TYPES = {
+    bool: 'bool',
+    int: 'number',
+    float: 'number',
+    str: 'str',
+    datetime.datetime: 'datetime',
+    datetime.date: 'datetime',
+    datetime.time: 'datetime',
+    datetime.timedelta: 'datetime',
+}
 
 
 class Cell(object):
-    def __init__(
-        self,
-        row,
-        col,
-        value=None,
-        style=None,
-        data_type=None,
-        **kwargs
-    ):
+    """A view of one position in a CellStore.
+
+    Reading or assigning value, style, data_type or kwargs goes straight
+    through to the store's arrays; the view itself only holds its location.
+    """
+    __slots__ = ('_store', 'row', 'col')
+
+    def __init__(self, store, row, col):
         # todo: url can have 'string' or 'tip' kwargs
+        self._store = store
         self.row = row
         self.col = col
-        self.value = value
-        self.style = style
-        self.data_type = data_type
-        self.kwargs = kwargs
+
+    @property
+    def value(self):
+        return self._store.get_value(self.row, self.col)
+
+    @value.setter
+    def value(self, value):
+        self._store.set_value(self.row, self.col, value)
+
+    @property
+    def style(self):
+        return self._store.get_style(self.row, self.col)
+
+    @style.setter
+    def style(self, style):
+        self._store.set_style(self.row, self.col, style)
+
+    @property
+    def data_type(self):
+        return self._store.get_type(self.row, self.col)
+
+    @data_type.setter
+    def data_type(self, data_type):
+        self._store.set_type(self.row, self.col, data_type)
+
+    @property
+    def kwargs(self):
+        return self._store.get_kwargs(self.row, self.col)
 
     def __str__(self):
         value = str(self.value) if self.value is not None else ''
@@ -61,13 +112,19 @@ class Cell(object):
             # print(style.name + ' is already in use.')
             pass
         elif self.style == style:
-            print(style.name + ' is identical to existing style.')
+            log.debug("%s is identical to existing style.", style.name)
             pass
         elif self.style.includes(style):
-            print(style.name + ' properties already included in ' + self.style.name)
+            log.debug(
+                "%s properties already included in %s",
+                style.name, self.style.name
+            )
             pass
         elif style.includes(self.style):
-            print(self.style.name + ' properties already included in ' + style.name)
+            log.debug(
+                "%s properties already included in %s",
+                self.style.name, style.name
+            )
             self.style = style
         else:
             self.style += style
@@ -91,42 +148,42 @@ class Cell(object):
 
     def write(self, sheet):
         fmt = self.get_format()
-        if self.style is None:
-            style_name = "None"
-        else:
-            style_name = self.style.name
         # print(f"r{self.row} c{self.col}: {style_name: <20}: {str(fmt)}")
-        if self.value is None or self.value == '':
-            return sheet.write_blank(self.row, self.col, '', fmt)
-        elif self.data_type == 'number':
-            return sheet.write_number(self.row, self.col, self.value, fmt)
-        elif self.data_type == 'str':
-            return sheet.write_string(self.row, self.col, self.value, fmt)
-        elif self.data_type == 'datetime':
-            return sheet.write_datetime(self.row, self.col, self.value, fmt)
-        elif self.data_type == 'formula':
-            return sheet.write_formula(
-                self.row,
-                self.col,
-                self.value,
-                fmt,
-                **self.kwargs
-            )
-        elif self.data_type == 'url':
-            return sheet.write_url(
-                self.row,
-                self.col,
-                self.value,
-                fmt,
-                **self.kwargs
-            )
-        else:
-            #todo: call more specific write function
-            return sheet.write(
-                self.row,
-                self.col,
-                self.value,
-                fmt,
-                **self.kwargs
-            )
-
+        return write_cell(
+            sheet,
+            self.row,
+            self.col,
+            self.value,
+            self.data_type,
+            fmt,
+            **self.kwargs
+        )
+
+
+def write_cell(sheet, row, col, value, data_type=None, fmt=None, **kwargs):
+    if value is None or (value == '' and not sheet.trusted_types):
+        return sheet._write_blank(row, col, '', fmt)
+    return sheet.cell_writer(data_type)(row, col, value, fmt, **kwargs)
+
+
+def cell_writer(sheet, data_type, trusted=False):
+    """Return the sheet's writer for values of one data_type.
+
+    The writer is called as writer(row, col, value, fmt, **kwargs) and
+    goes straight to xlsxwriter's undecorated method for the type. Values
+    without a data_type go through xlsxwriter's write(), which inspects
+    each one, or with trusted are written by their Python type alone, so
+    strings are never read as numbers, formulas or urls. Blank values are
+    left to the caller.
+    """
+    name = WRITERS.get(data_type)
+    if name is not None:
+        return getattr(sheet, name)
+    if not trusted:
+        return sheet._write
+    generic = sheet._write
+    writers = {t: getattr(sheet, WRITERS[d]) for t, d in TRUSTED_TYPES.items()}
+
+    def write(row, col, value, *args, **kwargs):
+        return writers.get(type(value), generic)(row, col, value, *args, **kwargs)
+    return write
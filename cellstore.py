@@ -0,0 +1,430 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from .cell import Cell
+from .spill import SpillFile
+
+COL_BITS = 14  # Excel has 16,384 columns
+COL_MASK = (1 << COL_BITS) - 1
+SPILLED = None  # stands in for a row bucket that is on disk
+
+
+def pack(row, col):
+    """Pack a zero indexed (row, col) pair into a single integer key."""
+    return (row << COL_BITS) | col
+
+
+def unpack(key):
+    return key >> COL_BITS, key & COL_MASK
+
+
+class RowBucket(object):
+    """The cells of one row as parallel arrays sorted by column."""
+    __slots__ = ('cols', 'values', 'types', 'styles', 'kwargs')
+
+    def __init__(self):
+        self.cols = array('H')
+        self.values = []
+        self.types = array('B')
+        self.styles = array('I')
+        self.kwargs = None
+
+    def __len__(self):
+        return len(self.cols)
+
+    def find(self, col):
+        """Index of col in the bucket, or -1."""
+        cols = self.cols
+        if cols and cols[-1] == col:
+            return len(cols) - 1
+        i = bisect_left(cols, col)
+        if i < len(cols) and cols[i] == col:
+            return i
+        return -1
+
+    def insert(self, col, value, type_id, style_id):
+        cols = self.cols
+        if not cols or cols[-1] < col:
+            i = len(cols)
+            cols.append(col)
+            self.values.append(value)
+            self.types.append(type_id)
+            self.styles.append(style_id)
+        else:
+            i = bisect_left(cols, col)
+            cols.insert(i, col)
+            self.values.insert(i, value)
+            self.types.insert(i, type_id)
+            self.styles.insert(i, style_id)
+        return i
+
+
+class CellStore(object):
+    """Integer keyed storage for the cells of a worksheet.
+
+    Cells are grouped into one RowBucket per row. Styles and data types are
+    stored as small integer ids into per-store tables, so a cell costs
+    about 15 bytes plus its value rather than a full object keyed by its A1
+    name (about 270 bytes). Each row also costs about 470 bytes for its
+    bucket, so the saving depends on the width of the rows: about 4x at 10
+    cells a row and 11x at 50, while a row of a single cell costs more than
+    it did as a Cell object.
+
+    Buckets are kept in row order as they are added. When a row arrives
+    out of order the row index is sorted once, the next time it is read,
+    so cells written top to bottom never need sorting.
+
+    spill() moves rows to a SpillFile on disk. A spilled row keeps its
+    place in the row index and is read back when it is next used; inside
+    reading() it is read without being kept in memory again.
+    """
+    data_types = (None, 'number', 'str', 'datetime', 'formula', 'url')
+    cell_bytes = 100  # rough memory use of a stored cell and its value
+    check_rows = 256  # new rows between calls to grow_hook
+    grow_hook = None
+    _spill = None
+    _spill_row = 0  # rows below this were spilled or kept on purpose
+    _keep = True
+    _read = None  # (row, bucket) last read in reading()
+
+    def __init__(self):
+        self._buckets = {}
+        self._count = 0
+        self._new_rows = 0
+        self.version = 0  # counts changes, to tell if cells were edited
+        self._last_row = -1
+        self._ordered = True
+        self._styles = [None]
+        self._built = 1
+        self._style_ids = {}
+        self._types = list(self.data_types)
+        self._type_ids = {t: i for i, t in enumerate(self._types)}
+
+    def __len__(self):
+        return self._count
+
+    def __getstate__(self):
+        # Spilled rows are read back into the copy; the file stays here.
+        state = self.__dict__.copy()
+        if self._spill is not None:
+            state['_buckets'] = {
+                row: self._bucket(row, False)
+                for row in self._buckets
+            }
+        state.pop('_spill', None)
+        state.pop('grow_hook', None)
+        state.pop('_read', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._style_ids = {
+            id(style): i for i, style in enumerate(self._styles) if i
+        }
+
+    def __contains__(self, key):
+        row, col = unpack(key)
+        bucket = self._bucket(row, False)
+        return bucket is not None and bucket.find(col) >= 0
+
+    def __iter__(self):
+        for row in self.rows():
+            for col in self.row_cols(row):
+                yield Cell(self, row, col)
+
+    def keys(self):
+        for row in self.rows():
+            for col in self.row_cols(row):
+                yield pack(row, col)
+
+    def _bucket(self, row, keep=None):
+        """The bucket of row, read back from disk if it was spilled."""
+        bucket = self._buckets.get(row, SPILLED)
+        if bucket is not SPILLED or self._spill is None or \
+                row not in self._spill:
+            return bucket
+        if keep is None:
+            keep = self._keep
+        if keep:
+            bucket = self._buckets[row] = self._spill.read(row)
+            self._read = None
+        elif self._read is not None and self._read[0] == row:
+            bucket = self._read[1]
+        else:
+            bucket = self._spill.read(row, remove=False)
+            self._read = (row, bucket)
+        return bucket
+
+    def spill(self, cells, keep_from=None, tmpdir=None):
+        """Move rows to disk, lowest first, until cells have moved.
+
+        Rows from keep_from down stay in memory. Returns the number of
+        cells spilled. Each call carries on from the row the last one
+        stopped at, so rows added above it later stay in memory.
+        """
+        if self._spill is None:
+            self._spill = SpillFile(tmpdir)
+        stop = self._last_row + 1 if keep_from is None else keep_from
+        buckets = self._buckets
+        row = self._spill_row
+        moved = 0
+        while moved < cells and row < stop:
+            bucket = buckets.get(row, SPILLED)
+            if bucket is not SPILLED:
+                self._spill.write(row, bucket)
+                buckets[row] = SPILLED
+                moved += len(bucket)
+            row += 1
+        self._spill_row = row
+        return moved
+
+    def close(self):
+        """Delete the spill file, dropping the rows spilled to it."""
+        if self._spill is None:
+            return
+        for row in [r for r, b in self._buckets.items() if b is SPILLED]:
+            del self._buckets[row]
+        self._count -= self._spill.cells
+        self._spill.close()
+        self._spill = None
+        self._read = None
+
+    @contextmanager
+    def reading(self):
+        """Read spilled rows without keeping them, e.g. while writing."""
+        keep, self._keep = self._keep, False
+        try:
+            yield self
+        finally:
+            self._keep = keep
+            self._read = None
+
+    def memory_usage(self):
+        """Cells and rows in memory and on disk, with estimated bytes."""
+        spilled = self._spill.cells if self._spill is not None else 0
+        spilled_rows = len(self._spill) if self._spill is not None else 0
+        return {
+            'cells': self._count - spilled,
+            'rows': len(self._buckets) - spilled_rows,
+            'bytes': (self._count - spilled) * self.cell_bytes,
+            'spilled_cells': spilled,
+            'spilled_rows': spilled_rows,
+            'spilled_bytes': self._spill.bytes if self._spill else 0,
+        }
+
+    def rows(self, upto=None):
+        """Row numbers holding at least one cell, in ascending order."""
+        if not self._ordered:
+            self._buckets = dict(sorted(self._buckets.items()))
+            self._ordered = True
+        if upto is None:
+            return list(self._buckets)
+        rows = []
+        for row in self._buckets:
+            if row >= upto:
+                break
+            rows.append(row)
+        return rows
+
+    def discard_rows(self, upto):
+        """Drop every row above upto."""
+        for row in self.rows(upto):
+            bucket = self._buckets.pop(row)
+            if bucket is SPILLED:
+                self._count -= self._spill.discard(row)
+            else:
+                self._count -= len(bucket)
+        self.version += 1
+
+    def discard_range(self, row1, col1, row2, col2):
+        """Drop every cell inside a rectangle."""
+        rows = {cell.row for cell in self.iter_range(row1, col1, row2, col2)}
+        for row in rows:
+            bucket = self._bucket(row, True)
+            lo = bisect_left(bucket.cols, col1)
+            hi = bisect_right(bucket.cols, col2)
+            for name in ('cols', 'values', 'types', 'styles'):
+                del getattr(bucket, name)[lo:hi]
+            if bucket.kwargs:
+                for col in range(col1, col2 + 1):
+                    bucket.kwargs.pop(col, None)
+            self._count -= hi - lo
+            if not bucket.cols:
+                del self._buckets[row]
+        self.version += 1
+
+    def row_cols(self, row):
+        bucket = self._bucket(row)
+        return bucket.cols if bucket is not None else ()
+
+    def row_count(self, row):
+        """Number of cells in row, without reading it back from disk."""
+        bucket = self._buckets.get(row)
+        if bucket is not None:
+            return len(bucket)
+        if self._spill is not None and row in self._spill:
+            return self._spill.row_cells(row)
+        return 0
+
+    def iter_row(self, row):
+        for col in self.row_cols(row):
+            yield Cell(self, row, col)
+
+    def iter_range(self, row1, col1, row2, col2):
+        """Cells inside a rectangle, without visiting empty positions."""
+        if row2 - row1 < len(self._buckets):
+            rows = [r for r in range(row1, row2 + 1) if r in self._buckets]
+        else:
+            rows = [r for r in self.rows() if row1 <= r <= row2]
+        for row in rows:
+            cols = self._bucket(row).cols
+            lo = bisect_left(cols, col1)
+            hi = bisect_right(cols, col2)
+            for col in cols[lo:hi]:
+                yield Cell(self, row, col)
+
+    def style_id(self, style):
+        if style is None:
+            return 0
+        style_id = self._style_ids.get(id(style))
+        if style_id is None:
+            style_id = len(self._styles)
+            self._styles.append(style)
+            self._style_ids[id(style)] = style_id
+        return style_id
+
+    def type_id(self, data_type):
+        type_id = self._type_ids.get(data_type)
+        if type_id is None:
+            type_id = len(self._types)
+            self._types.append(data_type)
+            self._type_ids[data_type] = type_id
+        return type_id
+
+    def get(self, row, col):
+        bucket = self._bucket(row)
+        if bucket is None or bucket.find(col) < 0:
+            return None
+        return Cell(self, row, col)
+
+    def add(self, row, col, value=None, style=None, data_type=None, **kwargs):
+        """Store a new cell, replacing any cell already at row, col."""
+        self.version += 1
+        bucket = self._bucket(row, True)
+        if bucket is None:
+            if row < self._last_row:
+                self._ordered = False
+            else:
+                self._last_row = row
+            bucket = self._buckets[row] = RowBucket()
+            self._new_rows += 1
+            if self._new_rows >= self.check_rows and self.grow_hook:
+                self._new_rows = 0
+                self.grow_hook(self, row)
+        i = bucket.find(col)
+        if i < 0:
+            bucket.insert(
+                col, value, self.type_id(data_type), self.style_id(style)
+            )
+            self._count += 1
+        else:
+            bucket.values[i] = value
+            bucket.types[i] = self.type_id(data_type)
+            bucket.styles[i] = self.style_id(style)
+        if kwargs:
+            if bucket.kwargs is None:
+                bucket.kwargs = {}
+            bucket.kwargs[col] = kwargs
+        elif bucket.kwargs:
+            bucket.kwargs.pop(col, None)
+        return Cell(self, row, col)
+
+    def _locate(self, row, col, keep=None):
+        bucket = self._bucket(row, keep)
+        i = bucket.find(col) if bucket is not None else -1
+        if i < 0:
+            raise KeyError(f"No cell at row {row}, col {col}.")
+        return bucket, i
+
+    def get_value(self, row, col):
+        bucket, i = self._locate(row, col)
+        return bucket.values[i]
+
+    def set_value(self, row, col, value):
+        bucket, i = self._locate(row, col, True)
+        bucket.values[i] = value
+        self.version += 1
+
+    def get_style(self, row, col):
+        bucket, i = self._locate(row, col)
+        return self._styles[bucket.styles[i]]
+
+    def set_style(self, row, col, style):
+        bucket, i = self._locate(row, col, True)
+        bucket.styles[i] = self.style_id(style)
+        self.version += 1
+
+    def get_type(self, row, col):
+        bucket, i = self._locate(row, col)
+        return self._types[bucket.types[i]]
+
+    def set_type(self, row, col, data_type):
+        bucket, i = self._locate(row, col, True)
+        bucket.types[i] = self.type_id(data_type)
+        self.version += 1
+
+    def get_kwargs(self, row, col):
+        bucket, i = self._locate(row, col)
+        if bucket.kwargs is None:
+            return {}
+        return bucket.kwargs.get(col, {})
+
+    def build_formats(self, stylesheet, workbook):
+        """Create workbook formats for styles added since the last call."""
+        for style in self._styles[self._built:]:
+            stylesheet.build_style(style, workbook)
+        self._built = len(self._styles)
+
+    def compile(self, sheet):
+        """Writers by data type id and formats by style id, for write_row().
+
+        Call after build_formats(); the result holds until new styles or
+        data types are added.
+        """
+        writers = [sheet.cell_writer(t) for t in self._types]
+        formats = [s.format if s is not None else None for s in self._styles]
+        return writers, formats
+
+    def write_row(self, sheet, row, skip=None, compiled=None, formats=None):
+        """Write the cells of one row, skipping any columns in skip.
+
+        Each cell costs one call to the writer compiled for its data type.
+        formats maps columns to formats that replace the cells' own.
+        """
+        bucket = self._bucket(row)
+        if bucket is None:
+            return
+        writers, style_formats = compiled or self.compile(sheet)
+        blank = sheet._write_blank
+        trusted = sheet.trusted_types
+        extra = bucket.kwargs
+        for col, value, type_id, style_id in zip(
+            bucket.cols, bucket.values, bucket.types, bucket.styles
+        ):
+            if skip is not None and col in skip:
+                continue
+            if formats and col in formats:
+                fmt = formats[col]
+            else:
+                fmt = style_formats[style_id]
+            if value is None or (not trusted and value == ''):
+                blank(row, col, '', fmt)
+            elif extra and col in extra:
+                writers[type_id](row, col, value, fmt, **extra[col])
+            else:
+                writers[type_id](row, col, value, fmt)
+
+    def write(self, sheet):
+        compiled = self.compile(sheet)
+        for row in self.rows():
+            self.write_row(sheet, row, compiled=compiled)
@@ -1,2 +1,10 @@
 class DuplicateKeyError(Exception):
     pass
+
+
+class RowFlushedError(Exception):
+    pass
+
+
+class OverlappingMergeError(Exception):
+    pass
@@ -9,6 +9,7 @@ class SimpleStyleSheet(StyleSheet):
         font_name="Century Gothic",
     ) -> None:
         self._styles = {}
+        self._init_tables()
         self._converted = False
         self.default = self.create('default', {'font_size': font_size, 'font_name': font_name})
         self.date = self.extend('date', {'num_format': 'm/d/yy'})
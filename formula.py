@@ -0,0 +1,170 @@
+import re
+from collections import namedtuple
+from xlsxwriter.utility import xl_col_to_name, xl_rowcol_to_cell, xl_range
+from .block import Block
+
+# Text in double quotes and quoted sheet names is never a reference.
+QUOTED = re.compile(r"(\"[^\"]*\"|'[^']*')")
+# A cell (A1), whole columns (A:C) or whole rows (1:3), in any case.
+REFERENCE = re.compile(
+    r"(?<![\w.$])(?:"
+    r"(?P<col_abs>\$?)(?P<col>[A-Z]{1,3})(?P<row_abs>\$?)(?P<row>[0-9]+)"
+    r"|(?P<col1_abs>\$?)(?P<col1>[A-Z]{1,3}):(?P<col2_abs>\$?)"
+    r"(?P<col2>[A-Z]{1,3})"
+    r"|(?P<row1_abs>\$?)(?P<row1>[0-9]+):(?P<row2_abs>\$?)(?P<row2>[0-9]+)"
+    r")(?![\w(])",
+    re.IGNORECASE,
+)
+MAX_ROW = 1048575
+MAX_COL = 16383
+
+# A cell of a shared formula group in the worksheet table. Only the
+# group's first cell holds the formula; the others have formula None.
+SharedFormula = namedtuple('SharedFormula', 'formula, format, value, si, ref')
+
+
+def _col(name):
+    col = 0
+    for letter in name.upper():
+        col = col * 26 + ord(letter) - 64
+    return col - 1
+
+
+def _reference(match):
+    """The parts of a matched reference: ('cell', row, col, row_abs,
+    col_abs), ('cols', col1, abs1, col2, abs2) or ('rows', ...), or None
+    for text that only looks like one, such as a column beyond XFD."""
+    groups = match.groupdict()
+    if groups['col'] is not None:
+        row, col = int(groups['row']) - 1, _col(groups['col'])
+        if not (0 <= row <= MAX_ROW and col <= MAX_COL):
+            return None
+        return ('cell', row, col, bool(groups['row_abs']),
+                bool(groups['col_abs']))
+    if groups['col1'] is not None:
+        first, last = _col(groups['col1']), _col(groups['col2'])
+        if max(first, last) > MAX_COL:
+            return None
+        return ('cols', first, bool(groups['col1_abs']),
+                last, bool(groups['col2_abs']))
+    first, last = int(groups['row1']) - 1, int(groups['row2']) - 1
+    if not (0 <= first <= MAX_ROW and 0 <= last <= MAX_ROW):
+        return None
+    return ('rows', first, bool(groups['row1_abs']),
+            last, bool(groups['row2_abs']))
+
+
+class FormulaTemplate(object):
+    """A formula written for one cell, parsed once to be moved to others.
+
+    Relative references move with the formula like Excel's fill down and
+    fill right; references with a $ stay put. Cell references, whole
+    columns (A:A) and whole rows (1:1) are moved, in either case, and
+    rendered in upper case as Excel shows them.
+    """
+
+    def __init__(self, formula):
+        self.formula = formula
+        self._parts = []  # literal text and reference tuples
+        text = ''
+        for i, chunk in enumerate(QUOTED.split(formula)):
+            if i % 2:
+                text += chunk
+                continue
+            start = 0
+            for match in REFERENCE.finditer(chunk):
+                part = _reference(match)
+                if part is None:
+                    continue
+                text += chunk[start:match.start()]
+                if text:
+                    self._parts.append(text)
+                    text = ''
+                self._parts.append(part)
+                start = match.end()
+            text += chunk[start:]
+        if text:
+            self._parts.append(text)
+
+    def render(self, rows=0, cols=0):
+        """The formula moved down rows and right cols."""
+        result = []
+        for part in self._parts:
+            if type(part) is str:
+                result.append(part)
+                continue
+            kind = part[0]
+            if kind == 'cell':
+                _, row, col, row_abs, col_abs = part
+                result.append(xl_rowcol_to_cell(
+                    row if row_abs else row + rows,
+                    col if col_abs else col + cols,
+                    row_abs, col_abs,
+                ))
+            elif kind == 'cols':
+                _, first, first_abs, last, last_abs = part
+                result.append('%s:%s' % (
+                    xl_col_to_name(first if first_abs else first + cols,
+                                   first_abs),
+                    xl_col_to_name(last if last_abs else last + cols,
+                                   last_abs),
+                ))
+            else:
+                _, first, first_abs, last, last_abs = part
+                result.append('%s%d:%s%d' % (
+                    '$' if first_abs else '',
+                    (first if first_abs else first + rows) + 1,
+                    '$' if last_abs else '',
+                    (last if last_abs else last + rows) + 1,
+                ))
+        return ''.join(result)
+
+
+class FormulaBlock(Block):
+    """A range filled with one formula template.
+
+    With a shared formula index (si) the first cell is written as the
+    master of an Excel shared formula and every other cell only refers to
+    it, so the formula text is stored once whatever the size of the
+    range. Without one, each cell gets its own rendered formula.
+    """
+
+    def __init__(self, row, col, num_rows, num_cols, template, style, si=None):
+        super().__init__(
+            row, col, [range(num_rows)] * num_cols,
+            [style] * num_cols, ['formula'] * num_cols,
+        )
+        self.template = template
+        self.si = si
+
+    def get_value(self, row, col):
+        return self.template.render(row - self.row, col - self.col)
+
+    def write_row(self, sheet, row, skip=None, formats=None):
+        if self.si is not None and row == self.row and skip and \
+                self.col in skip:
+            # A cell replaced the master, so write the formulas in full.
+            self.si = None
+        _, _, column_formats = self.compile(sheet)
+        col = self.col
+        for fmt in column_formats:
+            if skip is None or col not in skip:
+                if formats and col in formats:
+                    fmt = formats[col]
+                if self.si is None:
+                    sheet._write_formula(
+                        row, col,
+                        self.template.render(row - self.row, col - self.col),
+                        fmt,
+                    )
+                elif row == self.row and col == self.col:
+                    sheet._write_shared_formula(row, col, SharedFormula(
+                        self.template.formula.lstrip('='), fmt, 0, self.si,
+                        xl_range(self.row, self.col, self.last_row,
+                                 self.last_col),
+                    ))
+                else:
+                    sheet._write_shared_formula(
+                        row, col, SharedFormula(None, fmt, 0, self.si, None)
+                    )
+            col += 1
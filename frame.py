@@ -0,0 +1,97 @@
+def frame_columns(frame, index=False):
+    """Names and value arrays of a pandas DataFrame or Arrow table.
+
+    Returns (names, columns, num_index). Numeric columns come back as the
+    frame's own arrays where the library allows it. With index, the
+    levels of a DataFrame's index are put first.
+    """
+    if hasattr(frame, "column_names") and hasattr(frame, "column"):
+        names = list(frame.column_names)
+        columns = [frame.column(j).to_numpy() for j in range(len(names))]
+        return names, columns, 0
+    if not (hasattr(frame, "iloc") and hasattr(frame, "columns")):
+        raise TypeError(
+            f"Expected a pandas DataFrame or an Arrow table, "
+            f"got {type(frame).__name__}."
+        )
+    names = [_label(c) for c in frame.columns]
+    columns = [_series_values(frame.iloc[:, j]) for j in range(len(names))]
+    if not index:
+        return names, columns, 0
+    levels = frame.index.nlevels
+    names = [_label(n) for n in frame.index.names] + names
+    columns = [
+        _series_values(frame.index.get_level_values(i)) for i in range(levels)
+    ] + columns
+    return names, columns, levels
+
+
+def _label(label):
+    if label is None:
+        return ''
+    if isinstance(label, tuple):
+        return ' '.join(str(part) for part in label)
+    return str(label)
+
+
+def _series_values(series):
+    values = series.to_numpy()
+    if values.dtype.kind == "O":
+        # Missing values in object and extension columns become None.
+        values = series.to_numpy(dtype=object, na_value=None)
+    return values
+
+
+def convert_column(column, date_1904=False):
+    """Prepare one array column for writing and classify it.
+
+    Returns (values, kind) where kind is 'number', 'date', 'month' (dates
+    that all fall on the first of a month), 'str' or None. Dates become
+    Excel serial numbers, and missing numbers and dates become None.
+    Only columns with missing values, booleans or mixed objects are
+    turned into lists.
+    """
+    kind = column.dtype.kind
+    if kind in "iu":
+        return column, "number"
+    if kind == "f":
+        return _with_blanks(column), "number"
+    if kind == "M":
+        return _with_blanks(excel_dates(column, date_1904)), _date_kind(column)
+    if kind in "US":
+        return column, "str"
+    if kind == "O":
+        if all(v is None or isinstance(v, str) for v in column):
+            return column, "str"
+        return [None if v != v else v for v in column], None
+    return column.tolist(), None
+
+
+def excel_dates(column, date_1904=False):
+    """Excel serial day numbers for a datetime64 array, NaN for NaT."""
+    import numpy as np
+    epoch = np.datetime64("1904-01-01" if date_1904 else "1899-12-30")
+    days = (column - epoch) / np.timedelta64(1, "D")
+    if not date_1904:
+        # Excel counts 29 Feb 1900, so earlier dates are one day less.
+        days = np.where(days < 61, days - 1, days)
+        # Like write_datetime(), read 1 January 1900 as a time of day.
+        days = np.where((days >= 1) & (days < 2), days - 1, days)
+    return days
+
+
+def _date_kind(column):
+    valid = column == column
+    if not valid.any():
+        return "date"
+    months = column.astype("datetime64[M]").astype(column.dtype)
+    return "month" if (months == column)[valid].all() else "date"
+
+
+def _with_blanks(column):
+    missing = column != column
+    if not missing.any():
+        return column
+    return [
+        None if m else v for v, m in zip(column.tolist(), missing.tolist())
+    ]
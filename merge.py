@@ -0,0 +1,104 @@
+from bisect import bisect_right
+
+
+class Merge(object):
+    """A merged range shown as one cell holding value."""
+    __slots__ = (
+        'row1', 'col1', 'row2', 'col2', 'value', 'style', 'data_type',
+        'format',
+    )
+
+    def __init__(self, row1, col1, row2, col2, value, style, data_type):
+        self.row1 = row1
+        self.col1 = col1
+        self.row2 = row2
+        self.col2 = col2
+        self.value = value
+        self.style = style
+        self.data_type = data_type
+        self.format = None  # set when the first row is written
+
+    def covers(self, row, col):
+        return (
+            self.row1 <= row <= self.row2 and
+            self.col1 <= col <= self.col2
+        )
+
+
+class MergeIndex(object):
+    """Merged ranges filed under every row they cover.
+
+    Merges never overlap, so in each row they are disjoint column spans
+    kept sorted by first column. Finding the merge covering a cell is a
+    bisection of its row, and checking a new range for overlaps costs one
+    bisection per row of the range.
+    """
+
+    def __init__(self):
+        self._merges = []
+        self._rows = {}  # row: ([first columns], [merges]), sorted
+
+    def __len__(self):
+        return len(self._merges)
+
+    def __iter__(self):
+        return iter(self._merges)
+
+    def add(self, row1, col1, row2, col2, value=None, style=None,
+            data_type=None):
+        merge = Merge(row1, col1, row2, col2, value, style, data_type)
+        self._merges.append(merge)
+        for row in range(row1, row2 + 1):
+            starts, merges = self._rows.setdefault(row, ([], []))
+            i = bisect_right(starts, col1)
+            starts.insert(i, col1)
+            merges.insert(i, merge)
+        return merge
+
+    def find(self, row, col):
+        """The merge covering row, col, or None."""
+        entry = self._rows.get(row)
+        if entry is None:
+            return None
+        starts, merges = entry
+        i = bisect_right(starts, col) - 1
+        if i >= 0 and merges[i].col2 >= col:
+            return merges[i]
+        return None
+
+    def overlapping(self, row1, col1, row2, col2):
+        """A merge overlapping the range, or None."""
+        if row2 - row1 < len(self._rows):
+            rows = range(row1, row2 + 1)
+        else:
+            rows = [r for r in self._rows if row1 <= r <= row2]
+        for row in rows:
+            entry = self._rows.get(row)
+            if entry is None:
+                continue
+            starts, merges = entry
+            i = bisect_right(starts, col2) - 1
+            if i >= 0 and merges[i].col2 >= col1:
+                return merges[i]
+        return None
+
+    def row(self, row):
+        """The merges covering row, in column order."""
+        entry = self._rows.get(row)
+        return entry[1] if entry is not None else ()
+
+    def row_ranges(self, start=0, upto=None):
+        """The rows of each merge from start up to upto, as ranges."""
+        ranges = []
+        for m in self._merges:
+            stop = m.row2 + 1 if upto is None else min(m.row2 + 1, upto)
+            rows = range(max(m.row1, start), stop)
+            if rows:
+                ranges.append(rows)
+        return ranges
+
+    def discard_rows(self, upto):
+        """Drop the rows above upto and merges that end above it."""
+        self._merges = [m for m in self._merges if m.row2 >= upto]
+        for row in [r for r in self._rows if r < upto]:
+            del self._rows[row]
@@ -0,0 +1,97 @@
+class Overlay(object):
+    """A style applied to a rectangle of cells.
+
+    order is when it was applied among the sheet's overlays and blocks.
+    """
+    __slots__ = ('row1', 'col1', 'row2', 'col2', 'style', 'order')
+
+    def __init__(self, row1, col1, row2, col2, style, order=0):
+        self.row1 = row1
+        self.col1 = col1
+        self.row2 = row2
+        self.col2 = col2
+        self.style = style
+        self.order = order
+
+    def covers(self, row, col):
+        return (
+            self.row1 <= row <= self.row2 and
+            self.col1 <= col <= self.col2
+        )
+
+
+class OverlayIndex(object):
+    """Range overlays in the order they were applied.
+
+    Each overlay is also filed under every band of band_size rows it
+    touches, so finding the overlays for a row only looks at one band.
+    Recording an overlay costs O(1 + height / band_size), whatever its
+    area.
+    """
+    band_size = 64
+
+    def __init__(self):
+        self._overlays = []
+        self._bands = {}
+
+    def __len__(self):
+        return len(self._overlays)
+
+    def __iter__(self):
+        return iter(self._overlays)
+
+    def add(self, row1, col1, row2, col2, style, order=0):
+        overlay = Overlay(row1, col1, row2, col2, style, order)
+        self._overlays.append(overlay)
+        for band in range(row1 // self.band_size, row2 // self.band_size + 1):
+            self._bands.setdefault(band, []).append(overlay)
+        return overlay
+
+    def active(self, row):
+        """Overlays touching row, in the order they were applied."""
+        return [
+            o for o in self._bands.get(row // self.band_size, ())
+            if o.row1 <= row <= o.row2
+        ]
+
+    def covering(self, row, col):
+        """The overlays covering one cell, in applied order."""
+        return [
+            o for o in self._bands.get(row // self.band_size, ())
+            if o.covers(row, col)
+        ]
+
+    def segments(self, row):
+        """Split the overlays touching row into column spans.
+
+        Yields (first_col, stop_col, overlays) for each span covered by
+        the same overlays, in applied order.
+        """
+        active = self.active(row)
+        if not active:
+            return
+        points = sorted(
+            {o.col1 for o in active} | {o.col2 + 1 for o in active}
+        )
+        for start, stop in zip(points, points[1:]):
+            overlays = [
+                o for o in active if o.col1 <= start and o.col2 >= stop - 1
+            ]
+            if overlays:
+                yield start, stop, overlays
+
+    def row_ranges(self, start=0, upto=None):
+        """The rows of each overlay from start up to upto, as ranges."""
+        ranges = []
+        for o in self._overlays:
+            stop = o.row2 + 1 if upto is None else min(o.row2 + 1, upto)
+            rows = range(max(o.row1, start), stop)
+            if rows:
+                ranges.append(rows)
+        return ranges
+
+    def discard_rows(self, upto):
+        """Drop overlays that end above upto."""
+        self._overlays = [o for o in self._overlays if o.row2 >= upto]
+        for band in [b for b in self._bands if (b + 1) * self.band_size <= upto]:
+            del self._bands[band]
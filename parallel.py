@@ -0,0 +1,131 @@
+"""Building worksheets in worker processes.
+
+This relies on internals of the pinned XlsxWriter==1.3.6: the cell
+namedtuples of a worksheet's pending row, the attributes a build changes
+(XlWorksheet.build_state), the style attribute of the row XML, and how
+Format numbers itself with _get_xf_index(). Check them when upgrading.
+"""
+import copyreg
+import io
+import re
+from xlsxwriter import worksheet
+from xlsxwriter.workbook import Workbook
+from .stats import BuildStats
+
+# The style attribute of <c> and <row> tags. Attribute values are escaped,
+# so a tag never contains '>' and cell text never contains '<c '.
+STYLE_ATTR = re.compile(r'(<(?:c|row) [^>]*?\bs=")(\d+)(")')
+
+# xlsxwriter's cell namedtuples can't be found by their class names, so
+# pickling a sheet with a row still pending needs them registered.
+CELL_TUPLES = {
+    cls.__name__: cls for name, cls in vars(worksheet).items()
+    if name.startswith('cell_') and name.endswith('_tuple')
+}
+
+
+def cell_tuple(name, fields):
+    return CELL_TUPLES[name](*fields)
+
+
+def reduce_cell_tuple(cell):
+    return cell_tuple, (type(cell).__name__, tuple(cell))
+
+
+def register_cell_tuples():
+    """Let sheets with a pending row be pickled, for a parallel build."""
+    for cls in CELL_TUPLES.values():
+        if copyreg.dispatch_table.get(cls) is not reduce_cell_tuple:
+            copyreg.pickle(cls, reduce_cell_tuple)
+
+
+class FormatFactory(object):
+    """Stands in for the workbook while a sheet is built in a worker.
+
+    Formats are created exactly as Workbook.add_format() would create
+    them, numbered against a copy of the parent's format index table.
+    """
+    add_format = Workbook.add_format
+
+    def __init__(self, default_format_properties, excel2003_style,
+                 xf_format_indices, dxf_format_indices):
+        self.default_format_properties = default_format_properties
+        self.excel2003_style = excel2003_style
+        self.xf_format_indices = xf_format_indices
+        self.dxf_format_indices = dxf_format_indices
+        self.formats = []
+        self.stats = BuildStats()
+
+
+def build_worksheet(sheet, factory, last_row=True):
+    """Build sheet in a worker and return its row XML.
+
+    Returns (xml, formats, state, stats, style_formats): the <row>
+    elements of the sheet, the formats given an index by this build in
+    index order, the worksheet attributes the build changed, the build's
+    BuildStats and the format of each stylesheet style by style id.
+
+    Without last_row the last row is left pending in the state's table,
+    for the packager to write as it would after a serial build, so its
+    formats are numbered at the same point.
+    """
+    register_cell_tuples()
+    base = len(factory.xf_format_indices)
+    sheet.fh = sheet.row_data_fh = io.StringIO()
+    sheet.build(factory)
+    if last_row:
+        # -1 leaves nothing for the packager.
+        sheet._write_single_row(-1)
+
+    candidates = factory.formats + list(sheet.css._formats.values())
+    candidates += [sheet.default_date_format, sheet.default_url_format]
+    candidates += [options[1] for options in sheet.set_rows.values()]
+    candidates += list(sheet.col_formats.values())
+    formats = {
+        fmt.xf_index: fmt for fmt in candidates
+        if fmt is not None and fmt.xf_index is not None and fmt.xf_index > base
+    }
+    if len(formats) != len(factory.xf_format_indices) - base:
+        raise ValueError(
+            f"{sheet.name} used formats that were not created through its "
+            f"stylesheet and cannot be built in parallel."
+        )
+    state = {name: getattr(sheet, name) for name in sheet.build_state}
+    if not last_row:
+        state['table'] = sheet.table
+    style_formats = {
+        i: style.format for i, style in enumerate(sheet.css._by_id)
+        if style.format is not None
+    }
+    return (
+        sheet.row_data_fh.getvalue(),
+        [formats[i] for i in sorted(formats)],
+        state,
+        factory.stats,
+        style_formats,
+    )
+
+
+def state_formats(state):
+    """The formats held by a sheet's build state: row and column
+    formats and the cells of a pending row."""
+    for options in state.get('set_rows', {}).values():
+        yield options[1]
+    for info in state.get('colinfo', {}).values():
+        yield info[3]
+    yield from state.get('col_formats', {}).values()
+    for cells in state.get('table', {}).values():
+        for cell in cells.values():
+            yield getattr(cell, 'format', None)
+
+
+def renumber_formats(xml, indices):
+    """Replace the style indices in row XML using the indices mapping."""
+    if not indices:
+        return xml
+
+    def replace(match):
+        index = int(match.group(2))
+        return f"{match.group(1)}{indices.get(index, index)}{match.group(3)}"
+
+    return STYLE_ATTR.sub(replace, xml)
@@ -0,0 +1,121 @@
+import operator
+from itertools import compress
+from xlsxwriter.utility import xl_rowcol_to_cell
+
+# Tests that Excel's own conditional formats can make.
+COMPARISONS = {
+    '<': operator.lt, '<=': operator.le, '>': operator.gt,
+    '>=': operator.ge, '==': operator.eq, '!=': operator.ne,
+}
+RANGE_TESTS = ('between', 'not between')
+FORMULA_OPS = {'==': '=', '!=': '<>'}
+
+
+def excel_value(value):
+    """A Python value as an Excel formula constant."""
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, str):
+        return '"%s"' % value.replace('"', '""')
+    return repr(value)
+
+
+class StyleRule(object):
+    """A style for the values of a range that pass a test.
+
+    test is a comparison ('<', '<=', '>', '>=', '==', '!=') with value,
+    'between' or 'not between' with value a (low, high) pair, or a
+    function of a value. A vectorized function is called once with a
+    whole column: a list of cell values, or the sequence a block column
+    holds, such as a NumPy array slice. It returns a boolean for each.
+
+    With key_col the test is made on that column and every cell of a
+    matching row in the range gets the style. A row2 of None runs to
+    the last row of the sheet.
+
+    Native rules are written as Excel conditional formats; the others are
+    tested when the rows are built, and matching cells are written with
+    their own style combined with the rule's.
+    """
+    __slots__ = (
+        'row1', 'col1', 'row2', 'col2', 'style', 'test', 'value', 'key_col',
+        'vectorized', 'native',
+    )
+
+    def __init__(self, row1, col1, row2, col2, style, test, value=None,
+                 key_col=None, vectorized=False, native=None):
+        if not callable(test) and test not in COMPARISONS and \
+                test not in RANGE_TESTS:
+            raise ValueError(f"Unknown rule test {test!r}.")
+        if callable(test) and native:
+            raise ValueError("Only comparisons can be native rules.")
+        self.row1 = row1
+        self.col1 = col1
+        self.row2 = row2
+        self.col2 = col2
+        self.style = style
+        self.test = test
+        self.value = value
+        self.key_col = key_col
+        self.vectorized = vectorized
+        self.native = not callable(test) if native is None else native
+
+    def matches(self, values):
+        """A boolean for each of values, from one pass over the column."""
+        test = self.test
+        if callable(test):
+            if self.vectorized:
+                return test(values)
+            return [v is not None and bool(test(v)) for v in values]
+        if getattr(values, 'dtype', None) is not None and \
+                values.dtype.kind in 'iuf':
+            return self._compare(values)  # elementwise on the array
+        if isinstance(values, memoryview):
+            values = values.tolist()
+        result = []
+        for v in values:
+            try:
+                result.append(bool(self._compare(v)))
+            except TypeError:
+                result.append(False)
+        return result
+
+    def _compare(self, x):
+        if self.test in COMPARISONS:
+            return COMPARISONS[self.test](x, self.value)
+        low, high = self.value
+        if self.test == 'between':
+            return (x >= low) & (x <= high)
+        return (x < low) | (x > high)
+
+    def hits(self, rows, values):
+        """The rows whose values pass the test."""
+        result = self.matches(values)
+        if hasattr(result, 'nonzero'):
+            return [rows[i] for i in result.nonzero()[0]]
+        return list(compress(rows, result))
+
+    def conditional_format(self, fmt, last_row):
+        """Range and options for Worksheet.conditional_format()."""
+        row2 = last_row if self.row2 is None else self.row2
+        if self.key_col is None:
+            options = {'type': 'cell', 'criteria': self.test, 'format': fmt}
+            if self.test in RANGE_TESTS:
+                options['minimum'], options['maximum'] = (
+                    excel_value(v) for v in self.value
+                )
+            else:
+                options['value'] = excel_value(self.value)
+        else:
+            key = xl_rowcol_to_cell(self.row1, self.key_col, col_abs=True)
+            if self.test in RANGE_TESTS:
+                low, high = (excel_value(v) for v in self.value)
+                if self.test == 'between':
+                    formula = f'=AND({key}>={low},{key}<={high})'
+                else:
+                    formula = f'=OR({key}<{low},{key}>{high})'
+            else:
+                op = FORMULA_OPS.get(self.test, self.test)
+                formula = f'={key}{op}{excel_value(self.value)}'
+            options = {'type': 'formula', 'criteria': formula, 'format': fmt}
+        return (self.row1, self.col1, row2, self.col2, options)
@@ -0,0 +1,146 @@
+import copy
+import io
+import pickle
+from collections import namedtuple
+from .parallel import renumber_formats
+
+# A format in a saved build state, by its index in the captured workbook.
+FormatRef = namedtuple('FormatRef', 'index')
+
+
+def map_state_formats(state, convert):
+    """Copy of a sheet's build state with convert() applied to its formats."""
+    state = dict(state)
+    if 'set_rows' in state:
+        state['set_rows'] = {
+            row: [options[0], convert(options[1])] + list(options[2:])
+            for row, options in state['set_rows'].items()
+        }
+    if 'colinfo' in state:
+        state['colinfo'] = {
+            key: info[:3] + [convert(info[3])] + info[4:]
+            for key, info in state['colinfo'].items()
+        }
+    if 'col_formats' in state:
+        state['col_formats'] = {
+            col: convert(fmt) for col, fmt in state['col_formats'].items()
+        }
+    return state
+
+
+def capture_rows(sheet, workbook):
+    """Build sheet, returning its row XML and build state as well.
+
+    The rows still go to the sheet's own row file, as in a normal build.
+    """
+    row_data_fh = sheet.row_data_fh
+    sheet.fh = sheet.row_data_fh = io.StringIO()
+    try:
+        sheet.build(workbook)
+        sheet._write_single_row(-1)
+        xml = sheet.row_data_fh.getvalue()
+    finally:
+        sheet.fh = sheet.row_data_fh = row_data_fh
+    state = {name: copy.copy(getattr(sheet, name)) for name in sheet.build_state}
+    sheet.add_built_rows(xml, {})
+    return xml, state
+
+
+class SheetSnapshot(object):
+    """The row XML and build state of one captured sheet.
+
+    key is the sheet's layout_key() when it was captured; a restored sheet
+    with the same key has the same cells and values.
+    """
+
+    def __init__(self, name, key, xml, state):
+        self.name = name
+        self.key = key
+        self.xml = xml
+        self.state = state
+
+
+class WorkbookSnapshot(object):
+    """A built workbook's sheets, layout and output, to build it again.
+
+    Made by XlWorkbook.build(snapshot=True). workbook() returns a new
+    workbook holding the sheets as they were before the build, without
+    running their setup methods or combining styles again. Values changed
+    with XlWorksheet.set_value() are written as usual; sheets left as they
+    were reuse their captured rows instead of being written again.
+    """
+
+    def __init__(self, workbook, models, rows):
+        self.workbook_class = type(workbook)
+        self.options = workbook.init_options
+        self.properties = workbook.doc_properties
+        self.models = models  # pickled (stylesheet, worksheets)
+        self.sheets = {}
+        formats = {
+            fmt.xf_index: fmt for fmt in workbook.formats
+            if fmt.xf_index is not None
+        }
+        self.formats = {
+            index: copy.copy(fmt) for index, fmt in formats.items()
+        }
+
+        def ref(fmt):
+            return FormatRef(fmt._get_xf_index()) if fmt else fmt
+
+        for name, (key, xml, state) in rows.items():
+            self.sheets[name] = SheetSnapshot(
+                name, key, xml, map_state_formats(state, ref)
+            )
+
+    def workbook(self, filename, workbook_class=None):
+        """A new workbook with the captured sheets, ready to build."""
+        workbook_class = workbook_class or self.workbook_class
+        css, sheets = pickle.loads(self.models)
+        for style in css._styles.values():
+            style.format = None
+        for style in css._interned.values():
+            style.format = None
+        css._formats = {}
+        css._converted = False
+        wb = workbook_class(
+            filename, self.options, self.properties, stylesheet=css
+        )
+        for sheet in sheets:
+            for merge in sheet._merges:
+                merge.format = None
+            wb.add_sheet(sheet, sheet.name)
+            sheet._snapshot = self.sheets.get(sheet.name)
+        wb._snapshot = self
+        return wb
+
+    def restore_rows(self, sheet, workbook):
+        """Add a sheet's captured rows to workbook, renumbering formats."""
+        snapshot = self.sheets[sheet.name]
+        formats = workbook._snapshot_formats
+        if formats is None:
+            formats = workbook._snapshot_formats = {0: workbook.formats[0]}
+            for index in sorted(self.formats):
+                if index:
+                    fmt = formats[index] = copy.copy(self.formats[index])
+                    workbook._adopt_format(fmt)
+        indices = {index: fmt._get_xf_index() for index, fmt in formats.items()}
+        state = map_state_formats(
+            snapshot.state, lambda ref: formats[ref.index] if ref else ref
+        )
+        xml = renumber_formats(snapshot.xml, {
+            old: new for old, new in indices.items() if old != new
+        })
+        sheet.add_built_rows(xml, state)
+        return xml, state
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+        if not isinstance(snapshot, cls):
+            raise TypeError(f"{path} does not hold a workbook snapshot.")
+        return snapshot
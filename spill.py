@@ -0,0 +1,55 @@
+import pickle
+import tempfile
+
+
+class SpillFile(object):
+    """Rows of a cell store pickled to a temporary file.
+
+    Each row is appended to the file and found again through an index of
+    offsets, so a row is read back with one seek. Space left by rows
+    read back is not reused; the file is deleted when it is closed.
+    """
+
+    def __init__(self, tmpdir=None):
+        self._file = tempfile.TemporaryFile(dir=tmpdir)
+        self._index = {}  # row: (offset, size, cells)
+        self.cells = 0
+        self.bytes = 0  # size of the rows still held
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, row):
+        return row in self._index
+
+    def write(self, row, bucket):
+        data = pickle.dumps(bucket, pickle.HIGHEST_PROTOCOL)
+        offset = self._file.seek(0, 2)
+        self._file.write(data)
+        self._index[row] = (offset, len(data), len(bucket))
+        self.cells += len(bucket)
+        self.bytes += len(data)
+
+    def read(self, row, remove=True):
+        """The bucket spilled for row, dropped from the file with remove."""
+        offset, size, cells = self._index[row]
+        self._file.seek(offset)
+        bucket = pickle.loads(self._file.read(size))
+        if remove:
+            self.discard(row)
+        return bucket
+
+    def discard(self, row):
+        """Forget a spilled row and return its number of cells."""
+        _, size, cells = self._index.pop(row)
+        self.cells -= cells
+        self.bytes -= size
+        return cells
+
+    def row_cells(self, row):
+        return self._index[row][2]
+
+    def close(self):
+        self._file.close()
+        self._index.clear()
+        self.cells = self.bytes = 0
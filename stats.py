@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class BuildStats(object):
+    """Wall times and counts recorded while a workbook is built.
+
+    times and counts map (sheet, name) to seconds or a count, where sheet
+    is a worksheet name or None for the workbook as a whole. Each hook is
+    called as hook(kind, sheet, name, value) with kind 'time' or 'count'
+    whenever something is recorded.
+
+    Phases timed for each sheet are 'setup' (setup_header/_footer/_body),
+    'rules' (build time style rules), 'sort', 'build_formats' and
+    'write'; the workbook records 'build' and
+    'close' (assembling and zipping the file). Counts are 'cells' written
+    for each sheet and 'styles', 'formats', 'strings' (distinct strings
+    pooled), 'combine_hits', 'combine_misses' and 'bytes' for the
+    workbook.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.counts = {}
+        self.hooks = []
+
+    def __getstate__(self):
+        # Hooks stay with the workbook; merge() replays worker stats.
+        state = self.__dict__.copy()
+        state['hooks'] = []
+        return state
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    @contextmanager
+    def timer(self, name, sheet=None):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, perf_counter() - start, sheet)
+
+    def add_time(self, name, seconds, sheet=None):
+        key = (sheet, name)
+        self.times[key] = self.times.get(key, 0.0) + seconds
+        for hook in self.hooks:
+            hook('time', sheet, name, seconds)
+
+    def count(self, name, number=1, sheet=None):
+        key = (sheet, name)
+        self.counts[key] = self.counts.get(key, 0) + number
+        for hook in self.hooks:
+            hook('count', sheet, name, number)
+
+    def merge(self, other):
+        """Add the times and counts recorded by other."""
+        for (sheet, name), seconds in other.times.items():
+            self.add_time(name, seconds, sheet)
+        for (sheet, name), number in other.counts.items():
+            self.count(name, number, sheet)
+
+    def total(self, name):
+        """Time or count for name, summed over the workbook and sheets."""
+        source = self.times if any(
+            key[1] == name for key in self.times
+        ) else self.counts
+        return sum(value for key, value in source.items() if key[1] == name)
+
+    def as_dict(self):
+        """{sheet: {'times': {...}, 'counts': {...}}}, 'workbook' for None."""
+        result = {}
+        for kind, source in (('times', self.times), ('counts', self.counts)):
+            for (sheet, name), value in source.items():
+                entry = result.setdefault(
+                    'workbook' if sheet is None else sheet,
+                    {'times': {}, 'counts': {}},
+                )
+                entry[kind][name] = value
+        return result
+
+    def clear(self):
+        self.times.clear()
+        self.counts.clear()
@@ -0,0 +1,50 @@
+class StringPool(object):
+    """One shared object for each distinct string written to a workbook.
+
+    A label repeated across cells and sheets then costs one reference per
+    cell rather than a string each. The shared object also caches its
+    hash, so xlsxwriter's shared string table looks it up without hashing
+    the text again.
+
+    Strings stay in the pool for the life of the workbook, so it grows
+    with the distinct strings written. Streaming sheets and workbooks
+    with a memory budget don't use it, and a sheet that starts streaming
+    releases the strings it holds.
+    """
+
+    def __init__(self):
+        self._strings = {}
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __contains__(self, string):
+        return string in self._strings
+
+    def __iter__(self):
+        return iter(self._strings)
+
+    def intern(self, string):
+        """The pool's copy of string, adding string if it is new."""
+        return self._strings.setdefault(string, string)
+
+    def intern_column(self, column):
+        """A copy of a list or object array with its strings replaced by
+        pooled ones. column itself is left as it was."""
+        strings = self._strings
+        column = column.copy() if hasattr(column, "dtype") else list(column)
+        for i, value in enumerate(column):
+            if type(value) is str:
+                column[i] = strings.setdefault(value, value)
+        return column
+
+    def release(self, values):
+        """Drop the strings among values from the pool.
+
+        Whatever holds them keeps its objects; a string written again is
+        pooled anew.
+        """
+        strings = self._strings
+        for value in values:
+            if type(value) is str:
+                strings.pop(value, None)
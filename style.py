@@ -32,6 +32,12 @@ class Style(object):
     def __getattr__(self, name):
         return self._properties.get(name)
 
+    def __getstate__(self):
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
     def includes(self, other):
         '''True if all properties of other included and identical to self.'''
         result = True
@@ -53,6 +59,10 @@ class Style(object):
     def get_properties(self):
         return self._properties
 
+    def fingerprint(self):
+        '''Hashable key for the style's properties, ignoring its name.'''
+        return frozenset(self._properties.items())
+
     def build(self, workbook):
         if not self.format:
             self.format = workbook.add_format(self.get_properties())
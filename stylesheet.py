@@ -1,8 +1,11 @@
+import pickle
+from collections import OrderedDict
 from . import errors
 from .style import Style
 
 
 class StyleSheet:
+    combine_cache_size = 4096  # most recent combine() results kept
 
     def __init__(
         self,
@@ -12,6 +15,7 @@ class StyleSheet:
         font_name="Calibri",
     ) -> None:
         self._styles = {}
+        self._init_tables()
         formats = formats or {}
         if default_style is None:
             if "default" in formats:
@@ -87,9 +91,36 @@ class StyleSheet:
     def __getattr__(self, name):
         return self._styles.get(name)
 
+    def __getstate__(self):
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.__dict__.get('_interned') is None:
+            # Pickled before the tables were made in __init__.
+            self._init_tables()
+            for style in self._styles.values():
+                self._interned.setdefault(style.fingerprint(), style)
+                self._register(style)
+        else:
+            # id() keys don't survive pickling: renumber from _by_id.
+            self._ids = {id(s): i for i, s in enumerate(self._by_id)}
+        if self.__dict__.get('_formats') is None:
+            self._formats = {}
+
     def get(self, name):
         return self._styles.get(name)
 
+    def compile(self, combinations=()):
+        """Snapshot the resolved styles as a CompiledStyleSheet.
+
+        combinations are lists of style names to combine first, so their
+        results are already cached when the compiled sheet is loaded.
+        """
+        for names in combinations:
+            self.combine_styles(names)
+        return CompiledStyleSheet(self)
+
     def get_styles(self):
         return self._styles.items()
 
@@ -99,8 +130,127 @@ class StyleSheet:
         if not exists_ok and style.name in self._styles:
             raise errors.DuplicateKeyError(f"{style.name} is already in use.")
         self._styles[style.name] = style
+        self._interned.setdefault(style.fingerprint(), style)
+        self._register(style)
         return style
 
+    def _init_tables(self):
+        """Create the empty style tables, formats and combine() cache."""
+        self._interned = {}  # fingerprint: canonical style
+        self._ids = {}  # id(style): style id
+        self._by_id = []  # registered styles by style id
+        self._combined = OrderedDict()
+        self.combine_hits = 0
+        self.combine_misses = 0
+        self._formats = {}  # fingerprint: workbook format
+
+    def _register(self, style):
+        # Registered styles are kept alive in _by_id, so id(style) stays
+        # unique for as long as its number is in use.
+        if id(style) not in self._ids:
+            self._ids[id(style)] = len(self._by_id)
+            self._by_id.append(style)
+
+    def style_id(self, style):
+        """Small integer id of a registered style, or None."""
+        return self._ids.get(id(style))
+
+    def intern(self, style):
+        """Return the canonical style with the same properties as style.
+
+        The first style registered with a given set of properties becomes
+        the canonical one; style itself is registered if it is new.
+        """
+        table = self._interned
+        key = style.fingerprint()
+        canonical = table.get(key)
+        if canonical is None:
+            canonical = table[key] = style
+            self._styles.setdefault(style.name, style)
+            self._register(style)
+        return canonical
+
+    def combine(self, base, style):
+        """Canonical style with the properties of style layered over base.
+
+        Combining the same properties in any order or by any route returns
+        the same object, so a new Style is only made for a new property set.
+        Results for registered styles are cached by their style ids, so a
+        repeated combination is a single dict lookup.
+        """
+        if style is None:
+            return base
+        if base is None or base is style:
+            return self.intern(style)
+        key = (self._ids.get(id(base)), self._ids.get(id(style)))
+        cache = self._combined if None not in key else None
+        if cache is not None:
+            combined = cache.get(key)
+            if combined is not None:
+                cache.move_to_end(key)
+                self.combine_hits += 1
+                return combined
+        combined = self._merge(base, style)
+        self.combine_misses += 1
+        if cache is not None and self.combine_cache_size:
+            cache[key] = combined
+            if len(cache) > self.combine_cache_size:
+                cache.popitem(last=False)
+        return combined
+
+    def _merge(self, base, style):
+        properties = {**base.get_properties(), **style.get_properties()}
+        table = self._interned
+        key = frozenset(properties.items())
+        combined = table.get(key)
+        if combined is None:
+            combined = Style(base.name + "_" + style.name, properties)
+            table[key] = combined
+            self._styles.setdefault(combined.name, combined)
+            self._register(combined)
+        return combined
+
+    def box_style(
+        self, sides, border_style=1, border_color='black',
+        pattern=0, bg_color=0, fg_color=0
+    ):
+        """Canonical style for box() cells bordered on the given sides.
+
+        sides is a string holding any of 't', 'b', 'l' and 'r'. The name
+        holds the border and any fill, so boxes that differ only in their
+        fill get different names.
+        """
+        edges = {'t': 'top', 'b': 'bottom', 'l': 'left', 'r': 'right'}
+        properties = {edges[side]: border_style for side in sides}
+        if pattern:
+            properties['pattern'] = pattern
+        if bg_color:
+            properties['bg_color'] = bg_color
+        if fg_color:
+            properties['fg_color'] = fg_color
+        if properties and border_color:
+            properties['border_color'] = border_color
+        name = "_".join(
+            [f"box_{sides or 'fill'}_{border_style}_{border_color}"] + [
+                f"{key}_{properties[key]}"
+                for key in ('pattern', 'bg_color', 'fg_color')
+                if key in properties
+            ]
+        )
+        return self.intern(Style(name, properties))
+
+    def combine_cache_info(self):
+        return {
+            'hits': self.combine_hits,
+            'misses': self.combine_misses,
+            'size': len(self._combined),
+            'maxsize': self.combine_cache_size,
+        }
+
+    def clear_combine_cache(self):
+        """Forget cached combinations, e.g. after changing a style."""
+        self._combined.clear()
+
     def create(self, name, properties):
         if self.get(name):
             raise ValueError(f"Style name '{name}' is already in use.")
@@ -120,30 +270,182 @@ class StyleSheet:
 
     def combine_styles(self, styles) -> Style:
         """styles: list of string names of styles"""
-        name = "_".join(styles)
-        if name in self._styles:
-            return self._styles[name]
-        objects = []
+        combined = None
         # for style in sorted(styles): sorting impacts cascade
         for style in styles:
             obj = self.get(style)
             if obj is None:
                 raise ValueError(f"Style name does not exist: {style} ")
-            objects.append(obj)
-        combined = sum(objects)
-        self.add(combined, exists_ok=True)
+            combined = self.combine(combined, obj)
         return combined
 
     def name_in_use(self, name):
         return name in self._styles
 
     def build(self, workbook):
+        """Create formats for every style, whether it is used or not.
+
+        Worksheets don't need this: they call build_style() for the styles
+        their cells and rows actually reference.
+        """
         if not self._converted:
             for s in self._styles.values():
-                s.build(workbook)
+                self.build_style(s, workbook)
             self._converted = True
 
+    def build_style(self, style, workbook):
+        """Return the workbook format for style, creating it on first use.
+
+        Styles with identical properties share a single format.
+        """
+        if style.format is None:
+            key = style.fingerprint()
+            fmt = self._formats.get(key)
+            if fmt is None:
+                fmt = workbook.add_format(style.get_properties())
+                self._formats[key] = fmt
+            style.format = fmt
+        return style.format
+
+    def adopt_format(self, style, fmt):
+        """Give style a format made for it elsewhere, such as in a build
+        worker, unless it or a style with its properties has one."""
+        if style.format is None:
+            style.format = self._formats.setdefault(style.fingerprint(), fmt)
+        return style.format
+
+    def format_report(self):
+        """Count styles, the formats created for them and unused styles."""
+        styles = {id(s): s for s in self._styles.values()}
+        styles.update((id(s), s) for s in self._interned.values())
+        built = sum(1 for s in styles.values() if s.format is not None)
+        return {
+            'styles': len(styles),
+            'formats': len(self._formats),
+            'shared': built - len(self._formats),
+            'skipped': len(styles) - built,
+        }
+
     def print(self):
         for name, style in self._styles.items():
             print(style)
 
+
+class CompiledStyleSheet(object):
+    """Resolved styles of a StyleSheet, ready to load without merging.
+
+    Holds each style's properties, its names and attributes, the interned
+    styles and the combine() cache as plain data. stylesheet() makes a new
+    StyleSheet from them, skipping __init__ and setup_standard_styles().
+    save() and load() store it in a small pickle file after a header
+    holding the version.
+    """
+    version = 1
+    magic = b'XLCSS'  # starts the header of a saved file
+    # Sheet state that is rebuilt from the styles or belongs to a workbook.
+    internal = frozenset((
+        '_styles', '_interned', '_ids', '_by_id', '_combined',
+        'combine_hits', 'combine_misses', '_formats', '_converted',
+    ))
+
+    def __init__(self, css):
+        by_id = list(css._by_id)
+        ids = dict(css._ids)
+        attributes = {}
+        state = {}
+        for name, value in css.__dict__.items():
+            if name in self.internal:
+                continue
+            if isinstance(value, Style):
+                if id(value) not in ids:
+                    ids[id(value)] = len(by_id)
+                    by_id.append(value)
+                attributes[name] = ids[id(value)]
+            else:
+                state[name] = value
+        for style in css._styles.values():
+            if id(style) not in ids:
+                ids[id(style)] = len(by_id)
+                by_id.append(style)
+        self.cls = type(css)
+        self.styles = [(s.name, dict(s.get_properties())) for s in by_id]
+        self.names = {name: ids[id(s)] for name, s in css._styles.items()}
+        self.interned = [
+            (key, ids[id(s)]) for key, s in css._interned.items()
+            if id(s) in ids
+        ]
+        self.combined = [
+            (key, ids[id(s)]) for key, s in css._combined.items()
+            if id(s) in ids
+        ]
+        self.attributes = attributes
+        self.state = state
+
+    def __getstate__(self):
+        # Interned keys are the styles' own properties, so only the
+        # indices are stored and the keys are rebuilt on loading.
+        return (
+            self.version, self.cls, self.styles, self.names,
+            [i for _, i in self.interned], self.combined, self.attributes,
+            self.state,
+        )
+
+    def __setstate__(self, state):
+        if state[0] != self.version:
+            raise ValueError(
+                f"Compiled stylesheet version {state[0]} is not supported."
+            )
+        (_, self.cls, self.styles, self.names, interned,
+            self.combined, self.attributes, self.state) = state
+        self.interned = [
+            (frozenset(self.styles[i][1].items()), i) for i in interned
+        ]
+
+    def stylesheet(self):
+        """A new StyleSheet with the compiled styles, without formats."""
+        css = self.cls.__new__(self.cls)
+        by_id = [Style(name, dict(props)) for name, props in self.styles]
+        css.__dict__.update(self.state)
+        css.__dict__.update(
+            (name, by_id[i]) for name, i in self.attributes.items()
+        )
+        css._styles = {name: by_id[i] for name, i in self.names.items()}
+        css._interned = {key: by_id[i] for key, i in self.interned}
+        css._by_id = by_id
+        css._ids = {id(s): i for i, s in enumerate(by_id)}
+        css._combined = OrderedDict(
+            (key, by_id[i]) for key, i in self.combined
+        )
+        css.combine_hits = 0
+        css.combine_misses = 0
+        css._formats = {}
+        css._converted = False
+        return css
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(b'%s %d\n' % (self.magic, self.version))
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """Read a stylesheet written by save().
+
+        The file is unpickled, which can run any code it holds, so only
+        load files you trust. A file saved by a version of the format
+        other than this one raises ValueError before it is unpickled.
+        """
+        with open(path, 'rb') as f:
+            magic, _, version = f.readline(64).strip().partition(b' ')
+            if magic != cls.magic or not version.isdigit():
+                raise TypeError(f"{path} does not hold a compiled stylesheet.")
+            if int(version) != cls.version:
+                raise ValueError(
+                    f"{path} holds a version {int(version)} compiled "
+                    f"stylesheet; version {cls.version} is supported. "
+                    f"Compile the stylesheet again."
+                )
+            compiled = pickle.load(f)
+        if not isinstance(compiled, cls):
+            raise TypeError(f"{path} does not hold a compiled stylesheet.")
+        return compiled
@@ -0,0 +1,22 @@
+from xlmaker.benchmarks.bench import compare, run_workload, formula_totals
+
+
+def test_compare_flags_regressions_over_threshold():
+    baseline = {"a": {"time": 1.0, "peak_kib": 100, "size": 1000}}
+    results = {"a": {"time": 1.05, "peak_kib": 130, "size": 1000}}
+    assert compare(results, baseline, threshold=10) == [
+        ("a", "peak_kib", 100, 130)
+    ]
+    assert compare(results, baseline, threshold=50) == []
+
+
+def test_compare_skips_workloads_without_baseline():
+    results = {"new": {"time": 1.0, "peak_kib": 1, "size": 1}}
+    assert compare(results, {}, threshold=0) == []
+
+
+def test_run_workload_records_metrics():
+    metrics = run_workload(formula_totals, scale=0.02)
+    assert metrics["time"] > 0
+    assert metrics["peak_kib"] > 0
+    assert metrics["size"] > 0
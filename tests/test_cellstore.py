@@ -0,0 +1,100 @@
+import tracemalloc
+import pytest
+from xlmaker import Style
+from xlmaker.cellstore import CellStore, pack, unpack
+
+
+@pytest.fixture
+def store():
+    return CellStore()
+
+
+def test_pack_unpack_roundtrip():
+    assert unpack(pack(1048575, 16383)) == (1048575, 16383)
+    assert pack(1, 0) > pack(0, 16383)
+
+
+def test_add_and_get(store):
+    bold = Style("bold", {"bold": True})
+    store.add(3, 2, 99, bold, "number")
+    cell = store.get(3, 2)
+    assert (cell.row, cell.col) == (3, 2)
+    assert cell.value == 99
+    assert cell.style is bold
+    assert cell.data_type == "number"
+    assert store.get(3, 1) is None
+    assert store.get(4, 2) is None
+    assert pack(3, 2) in store
+
+
+def test_cells_iterate_in_write_order(store):
+    store.add(2, 5, "c")
+    store.add(0, 3, "b")
+    store.add(2, 1, "d")
+    store.add(0, 0, "a")
+    assert [c.value for c in store] == ["a", "b", "d", "c"]
+    assert list(store.keys()) == sorted(store.keys())
+    assert len(store) == 4
+
+
+def test_cell_view_writes_through(store):
+    cell = store.add(0, 0, 1)
+    cell.set_value(2)
+    cell.set_type("formula")
+    assert store.get(0, 0).value == 2
+    assert store.get(0, 0).data_type == "formula"
+
+
+def test_add_replaces_existing(store):
+    store.add(0, 0, 1, data_type="number")
+    store.add(0, 0, "x", data_type="str")
+    assert len(store) == 1
+    assert store.get(0, 0).value == "x"
+    assert store.get(0, 0).data_type == "str"
+
+
+def test_rows_in_order_skip_sorting(store):
+    for row in range(5):
+        store.add(row, 1, row)
+        store.add(row, 0, row)
+    assert store._ordered
+    assert store.rows() == [0, 1, 2, 3, 4]
+    assert list(store.row_cols(2)) == [0, 1]
+
+
+def test_out_of_order_rows_sorted_once(store):
+    store.add(5, 0)
+    store.add(1, 0)
+    assert not store._ordered
+    assert store.rows(upto=5) == [1]
+    assert store._ordered
+    store.discard_rows(5)
+    assert store.rows() == [5]
+    assert len(store) == 1
+
+
+def test_spill_carries_on_from_last_row_spilled(store, tmp_path):
+    for row in range(10):
+        store.add(row, 0, row)
+    assert store.spill(3, tmpdir=tmp_path) == 3
+    assert store.get_value(1, 0) == 1  # read back and kept
+    assert store.spill(3, keep_from=8, tmpdir=tmp_path) == 3
+    assert store.memory_usage()["spilled_rows"] == 5
+    assert store.get_value(5, 0) == 5
+    assert store.spill(5, keep_from=8, tmpdir=tmp_path) == 2
+    store.close()
+    assert store.rows() == [1, 5, 8, 9]
+    assert len(store) == 4
+
+
+@pytest.mark.parametrize("width, most", [(1, 600), (10, 80), (50, 30)])
+def test_bytes_per_cell(width, most):
+    bold = Style("bold", {"bold": True})
+    tracemalloc.start()
+    store = CellStore()
+    for row in range(20000 // width):
+        for col in range(width):
+            store.add(row, col, 0.5, bold, "number")
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert used / len(store) < most
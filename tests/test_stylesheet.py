@@ -1,5 +1,6 @@
 import pytest
-from xlmaker import StyleSheet
+from xlmaker import Style, StyleSheet, CompiledStyleSheet, XlWorkbook
+from xlmaker.examples.simple_stylesheet import SimpleStyleSheet
 
 
 @pytest.fixture
@@ -39,3 +40,114 @@ def test_stylesheet_load_styles(css):
 def test_cannot_add_duplicate_name(css):
     with pytest.raises(Exception) as e_info:
         css.create('default', {'align': 'center'})
+
+
+def test_only_used_styles_get_formats(tmp_path):
+    css = StyleSheet()
+    wb = XlWorkbook(filename=str(tmp_path / "lazy.xlsx"), stylesheet=css)
+    ws = wb.add_worksheet("test1")
+    ws.cell(1, css.bold)
+    ws.cell(2, css.under)
+    ws.cell(3)
+    wb.build()
+    report = css.format_report()
+    assert css.centered.format is None
+    assert report["formats"] == 3
+    assert report["skipped"] == report["styles"] - 3
+
+
+def test_styles_with_same_properties_share_a_format(tmp_path):
+    css = StyleSheet()
+    wb = XlWorkbook(filename=str(tmp_path / "shared.xlsx"), stylesheet=css)
+    bold_again = css.extend("bold_again", {"bold": True})
+    assert css.build_style(bold_again, wb) is css.build_style(css.bold, wb)
+    assert css.format_report()["shared"] == 1
+
+
+def test_combine_is_order_independent(css):
+    italic = css.extend("italic", {"italic": True})
+    wide = css.extend("wide", {"align": "center"})
+    assert css.combine(italic, wide) is css.combine(wide, italic)
+    assert css.combine_styles(["italic", "wide"]) is css.combine(wide, italic)
+    assert css.combine(italic, css.default) is italic
+
+
+def test_intern_returns_canonical_style(css):
+    css.create("a", {"bold": True})
+    assert css.intern(Style("b", {"bold": True})) is css.a
+    other = Style("c", {"italic": True})
+    assert css.intern(other) is other
+    assert css.c is other
+
+
+def test_combine_cache_counts_hits(css):
+    css.combine(css.bold, css.under)
+    first = css.combine_cache_info()
+    assert css.combine(css.bold, css.under) is css.combine(css.bold, css.under)
+    info = css.combine_cache_info()
+    assert info["hits"] == first["hits"] + 2
+    assert info["misses"] == first["misses"]
+
+
+def test_combine_cache_evicts_least_recently_used(css):
+    css.combine_cache_size = 2
+    css.clear_combine_cache()
+    css.combine(css.bold, css.under)
+    css.combine(css.bold, css.wrap)
+    css.combine(css.bold, css.under)
+    css.combine(css.bold, css.indent)
+    assert css.combine_cache_info()["size"] == 2
+    misses = css.combine_cache_info()["misses"]
+    css.combine(css.bold, css.under)
+    css.combine(css.bold, css.wrap)
+    assert css.combine_cache_info()["misses"] == misses + 1
+
+
+def test_compiled_stylesheet_loads_without_setup(tmp_path):
+    from xlmaker.examples.example_stylesheet import StyleSheetTemplate
+    css = StyleSheetTemplate()
+    path = tmp_path / "styles.xlcss"
+    css.compile([["bold", "grey"]]).save(path)
+    with pytest.raises(TypeError):
+        XlWorkbook(filename=str(tmp_path / "path.xlsx"), stylesheet=path)
+    wb = XlWorkbook(filename=str(tmp_path / "compiled.xlsx"),
+                    stylesheet=CompiledStyleSheet.load(path))
+    loaded = wb.css
+    assert type(loaded) is StyleSheetTemplate
+    assert loaded.tableheader.get_properties() == \
+        css.tableheader.get_properties()
+    assert loaded.get("th_left") is loaded.th_left
+    assert loaded.combine_styles(["bold", "grey"]).name == "bold_grey"
+    assert loaded.combine_cache_info()["hits"] == 1
+    assert loaded.intern(Style("x", {**css.bold.get_properties()})) \
+        is loaded.bold
+    ws = wb.add_worksheet("test1")
+    ws.cell(1, ["bold", "grey"])
+    wb.build(quiet=True)
+    assert loaded.get("bold_grey").format is not None
+    assert css.get("bold_grey").format is None
+
+
+def test_stylesheet_pickled_without_tables_gets_them(css):
+    state = {
+        name: value for name, value in css.__dict__.items()
+        if name not in CompiledStyleSheet.internal or name == "_styles"
+    }
+    loaded = StyleSheet.__new__(StyleSheet)
+    loaded.__setstate__(state)
+    assert loaded.intern(Style("b", {**css.bold.get_properties()})) \
+        is loaded.bold
+    assert loaded.style_id(loaded.default) == 0
+    assert loaded.format_report()["formats"] == 0
+
+
+def test_compiled_stylesheet_checks_file_version(tmp_path):
+    path = tmp_path / "styles.xlcss"
+    SimpleStyleSheet().compile().save(path)
+    data = path.read_bytes()
+    path.write_bytes(data.replace(b"XLCSS 1\n", b"XLCSS 2\n", 1))
+    with pytest.raises(ValueError, match="version 2"):
+        CompiledStyleSheet.load(path)
+    path.write_bytes(b"not a stylesheet")
+    with pytest.raises(TypeError):
+        CompiledStyleSheet.load(path)
@@ -0,0 +1,332 @@
+import io
+import random
+from array import array
+from datetime import datetime
+from zipfile import ZipFile
+from xlmaker.workbook import XlWorkbook
+from xlmaker.batch import run_batch
+from xlmaker.snapshot import WorkbookSnapshot
+from xlmaker.examples.simple_stylesheet import SimpleStyleSheet
+import pytest
+
+
+def board_pack(path, streaming=True):
+    css = SimpleStyleSheet()
+    wb = XlWorkbook(
+        filename=path,
+        properties={'created': datetime(2024, 1, 1)},
+        stylesheet=css,
+    )
+    for s in range(4):
+        ws = wb.add_worksheet(f"sheet{s}")
+        if s == 3 and streaming:
+            ws.streaming = True
+        ws.row_style(20, css.bold, row=0)
+        ws.col_style(css.tableheader if s % 2 else css.grey, 2)
+        ws.merge_cells(0, 5, 1, 6, f"Merged {s}", css.bold)
+        ws.cell("Heading", ["bold", "grey"])
+        ws.next_row()
+        ws.format_range(1, 0, 3, 4, css.grey)
+        ws.box(2, 1, 5, 3)
+        values = memoryview(array('d', range(12 * (s + 1))))
+        ws.write_block(values.cast('B').cast('d', [4 * (s + 1), 3]),
+            col_styles=[css.date, None, "bold"])
+        for r in range(5):
+            ws.number(r * s, css.tableheader if s % 2 else css.date)
+            ws.cell(f"=A{r + 1}*2", [("mmm_yy", "date")[s % 2], "bold"],
+                "formula")
+            ws.next_row()
+    return wb
+
+
+def test_parallel_build_matches_serial_build(tmp_path):
+    serial = board_pack(tmp_path / "serial.xlsx")
+    serial.build()
+    parallel = board_pack(tmp_path / "parallel.xlsx")
+    parallel.build(workers=2)
+    a, b = ZipFile(serial.filename), ZipFile(parallel.filename)
+    assert a.namelist() == b.namelist()
+    for name in a.namelist():
+        assert a.read(name) == b.read(name), name
+
+
+def test_parallel_build_gives_styles_their_formats(tmp_path):
+    serial = board_pack(tmp_path / "serial.xlsx")
+    serial.build(quiet=True)
+    parallel = board_pack(tmp_path / "parallel.xlsx")
+    parallel.build(workers=2, quiet=True)
+    built = [
+        name for name, style in serial.css._styles.items()
+        if style.format and name in parallel.css._styles
+    ]
+    assert "mmm_yy_bold" in built
+    for name in built:
+        fmt = parallel.css._styles[name].format
+        assert fmt is not None and fmt in parallel.formats, name
+        assert fmt._get_xf_index() == \
+            serial.css._styles[name].format._get_xf_index(), name
+
+
+STYLE_NAMES = ["bold", "grey", "date", "tableheader", "mmm_yy"]
+
+
+def random_workbook(path, seed):
+    rnd = random.Random(seed)
+    wb = XlWorkbook(filename=path, stylesheet=SimpleStyleSheet(),
+                    properties={'created': datetime(2024, 1, 1)})
+
+    def style():
+        return rnd.sample(STYLE_NAMES, rnd.randint(0, 2)) or None
+
+    for s in range(rnd.randint(2, 4)):
+        ws = wb.add_worksheet(f"s{s}")
+        if rnd.random() < 0.3:
+            ws.col_style(rnd.choice(STYLE_NAMES), rnd.randint(0, 4))
+        for r in range(rnd.randint(1, 25)):
+            if rnd.random() < 0.15:
+                ws.row_style(15, style(), row=r)
+            for c in range(rnd.randint(1, 6)):
+                kind = rnd.random()
+                if kind < 0.5:
+                    ws.number(rnd.randint(-50, 50), style(), row=r, col=c)
+                elif kind < 0.7:
+                    ws.string(f"t{rnd.randint(0, 9)}", style(), row=r, col=c)
+                elif kind < 0.8:
+                    ws.cell(datetime(2024, 1, rnd.randint(1, 28)), style(),
+                            row=r, col=c)
+                elif kind < 0.9:
+                    ws.cell(f"=A{r + 1}+1", style(), "formula", row=r, col=c)
+        if rnd.random() < 0.4:
+            r = rnd.randint(0, 20)
+            ws.format_range(r, 0, r + rnd.randint(0, 4), rnd.randint(0, 5),
+                            rnd.choice(STYLE_NAMES))
+        if rnd.random() < 0.4:
+            ws.write_block([[rnd.randint(0, 9)] * 3] * rnd.randint(1, 5),
+                           row=30, col=0,
+                           col_styles=[rnd.choice(STYLE_NAMES + [None])
+                                       for _ in range(3)])
+        if rnd.random() < 0.3:
+            ws.merge_cells(40, 1, 41, 2, "m", style())
+    return wb
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_parallel_build_matches_serial_build_randomly(tmp_path, seed):
+    serial = random_workbook(str(tmp_path / "serial.xlsx"), seed)
+    serial.build(quiet=True)
+    parallel = random_workbook(str(tmp_path / "parallel.xlsx"), seed)
+    parallel.build(workers=2, quiet=True)
+    a, b = ZipFile(serial.filename), ZipFile(parallel.filename)
+    for name in a.namelist():
+        assert a.read(name) == b.read(name), name
+
+
+def test_build_records_stats_and_calls_hooks(tmp_path, capsys):
+    wb = board_pack(tmp_path / "stats.xlsx")
+    events = []
+    wb.stats.add_hook(lambda *event: events.append(event))
+    wb.build(quiet=True)
+    assert capsys.readouterr().out == ""
+    stats = wb.stats.as_dict()
+    assert set(stats) == {"workbook", "sheet0", "sheet1", "sheet2", "sheet3"}
+    assert {"sort", "build_formats", "write"} <= set(stats["sheet0"]["times"])
+    assert stats["sheet0"]["counts"]["cells"] == 1 + 12 + 10
+    assert stats["workbook"]["counts"]["bytes"] > 0
+    assert stats["workbook"]["counts"]["formats"] == len(wb.xf_format_indices)
+    assert wb.stats.total("build") >= wb.stats.total("close")
+    assert ("count", "sheet1", "cells", 24 + 1 + 10) in events
+
+
+def test_parallel_build_merges_worker_stats(tmp_path):
+    wb = board_pack(tmp_path / "stats.xlsx")
+    wb.build(workers=2, quiet=True)
+    assert wb.stats.counts[("sheet2", "cells")] == 36 + 1 + 10
+    assert ("sheet2", "write") in wb.stats.times
+
+
+def test_string_values_share_one_object_per_workbook(tmp_path):
+    wb = XlWorkbook(filename=str(tmp_path / "strings.xlsx"))
+    first, second = wb.add_worksheet("a"), wb.add_worksheet("b")
+    label = "".join(["Net ", "revenue"])
+    first.string("Net revenue")
+    second.cell(label, row=3, col=0)
+    block = second.write_block([["Net revenue", 1], [label, 2]], row=5)
+    pooled = first.get_cell(0, 0).value
+    assert second.get_cell(3, 0).value is pooled
+    assert all(value is pooled for value in block.columns[0])
+    assert len(wb.strings) == 1
+
+
+def test_streaming_and_budgeted_sheets_do_not_pool_strings(tmp_path):
+    wb = XlWorkbook(filename=str(tmp_path / "unpooled.xlsx"))
+    ws = wb.add_worksheet("stream")
+    ws.streaming = True
+    ws.string("Net revenue")
+    ws.write_block([["Gross margin"]], row=1)
+    assert len(wb.strings) == 0
+    budgeted = XlWorkbook(filename=str(tmp_path / "budget.xlsx"))
+    budgeted.memory_budget = 10_000
+    budgeted.add_worksheet("a").string("Net revenue")
+    assert len(budgeted.strings) == 0
+
+
+def test_pooling_leaves_callers_columns_and_stops_when_streaming(tmp_path):
+    wb = XlWorkbook(filename=str(tmp_path / "pooled.xlsx"))
+    ws = wb.add_worksheet("a")
+    ws.string("Net revenue")
+    labels = ["".join(["Gross ", "margin"])]
+    block = ws.write_block([labels], orient="columns", row=1)
+    assert block.columns[0] is not labels
+    assert block.columns[0][0] is wb.strings.intern("Gross margin")
+    ws.streaming = True
+    assert len(wb.strings) == 0
+    ws.string("Net income")
+    assert len(wb.strings) == 0
+
+
+def test_build_async_writes_to_bytesio(tmp_path):
+    serial = board_pack(tmp_path / "serial.xlsx")
+    serial.build(quiet=True)
+    target = io.BytesIO()
+    wb = board_pack(target)
+    future = wb.build_async()
+    assert future.result(timeout=30) is target
+    a, b = ZipFile(serial.filename), ZipFile(target)
+    for name in a.namelist():
+        assert a.read(name) == b.read(name), name
+    assert wb.stats.counts[(None, "bytes")] == len(target.getvalue())
+
+
+def client_report(wb, client, amount):
+    if amount < 0:
+        raise ValueError("negative amount")
+    ws = wb.add_worksheet(client)
+    ws.cell(client, "bold")
+    ws.number(amount, "currency")
+
+
+def test_run_batch_isolates_failures(tmp_path):
+    jobs = ({"client": f"c{i}", "amount": i - 1} for i in range(5))
+    summary = run_batch(
+        client_report, jobs, filename=str(tmp_path / "{client}.xlsx"),
+        stylesheet=SimpleStyleSheet(), workers=2, max_pending=2,
+    )
+    assert [r.filename for r in summary.failed] == [str(tmp_path / "c0.xlsx")]
+    assert "negative amount" in summary.failed[0].error
+    assert [r.index for r in summary.succeeded] == [1, 2, 3, 4]
+    assert all(r.bytes > 0 and r.seconds > 0 for r in summary.succeeded)
+    assert (tmp_path / "c4.xlsx").exists()
+    assert summary.as_dict()["failed"] == 1
+
+
+def failing_rule_report(wb, client):
+    ws = wb.add_worksheet(client)
+    ws.cell(client, "bold")
+    ws.column_rule(0, "bold", lambda value: 1 / 0)  # raises while building
+
+
+class FailingCloseWorkbook(XlWorkbook):
+    def close(self):
+        super().close()
+        raise OSError("disk full")
+
+
+def test_run_batch_discards_failed_workbooks(tmp_path):
+    tmpdir = tmp_path / "tmp"
+    tmpdir.mkdir()
+    options = {"tmpdir": str(tmpdir)}
+    summary = run_batch(
+        failing_rule_report, [{"client": "c0"}],
+        filename=str(tmp_path / "{client}.xlsx"), options=options,
+    )
+    assert "ZeroDivisionError" in summary.failed[0].error
+    summary = run_batch(
+        client_report, [{"client": "c1", "amount": 1}],
+        filename=str(tmp_path / "{client}.xlsx"), options=options,
+        workbook_class=FailingCloseWorkbook,
+    )
+    assert "disk full" in summary.failed[0].error
+    assert not (tmp_path / "c0.xlsx").exists()
+    assert not (tmp_path / "c1.xlsx").exists()
+    assert list(tmpdir.iterdir()) == []
+
+
+def test_snapshot_reuses_unchanged_sheets(tmp_path):
+    wb = board_pack(tmp_path / "first.xlsx", streaming=False)
+    wb.build(quiet=True, snapshot=True)
+    wb.snapshot.save(tmp_path / "report.snapshot")
+    snapshot = WorkbookSnapshot.load(tmp_path / "report.snapshot")
+    again = snapshot.workbook(str(tmp_path / "again.xlsx"))
+    again.sheetnames["sheet1"].set_value(0, 0, "Changed")
+    again.sheetnames["sheet2"].set_value(2, 1, 99.5)
+    again.sheetnames["sheet3"].set_value(0, 0, "Heading")
+    again.build(quiet=True)
+    reused = [s for s, name in again.stats.counts if name == "reused"]
+    assert reused == ["sheet0", "sheet3"]
+    full = board_pack(tmp_path / "full.xlsx", streaming=False)
+    full.sheetnames["sheet1"].set_value(0, 0, "Changed")
+    full.sheetnames["sheet2"].set_value(2, 1, 99.5)
+    full.build(quiet=True)
+    a, b = ZipFile(full.filename), ZipFile(again.filename)
+    for name in a.namelist():
+        assert a.read(name) == b.read(name), name
+
+
+def ledger(path, budget=None):
+    wb = XlWorkbook(
+        filename=path, properties={'created': datetime(2024, 1, 1)},
+        stylesheet=SimpleStyleSheet(),
+    )
+    wb.memory_budget = budget
+    ws = wb.add_worksheet("ledger")
+    ws.spill_window = 100
+    for r in range(3000):
+        for c in range(4):
+            ws.number(r * c, "date" if c == 3 else None)
+        ws.cell(f"Row {r}")
+        ws.next_row()
+    ws.format_cell(5, 1, "bold")
+    ws.vtotal(3000, "bold", col=2)
+    return wb
+
+
+def test_memory_budget_spills_rows_to_disk(tmp_path):
+    full = ledger(tmp_path / "full.xlsx")
+    in_memory = full.memory_usage()["ledger"]
+    assert in_memory["spilled_cells"] == 0
+    spilled = ledger(tmp_path / "spilled.xlsx", budget=200_000)
+    usage = spilled.memory_usage()["ledger"]
+    assert usage["spilled_cells"] > 10000
+    assert usage["bytes"] < in_memory["bytes"] / 4
+    assert usage["cells"] + usage["spilled_cells"] == 15001
+    store = spilled.sheetnames["ledger"]._cells
+    assert store.get_value(2999, 4) == "Row 2999"
+    spill_file = store._spill._file
+    full.build(quiet=True)
+    spilled.build(quiet=True)
+    assert spill_file.closed
+    assert spilled.memory_usage()["ledger"]["spilled_cells"] == 0
+    a, b = ZipFile(full.filename), ZipFile(spilled.filename)
+    for name in a.namelist():
+        assert a.read(name) == b.read(name), name
+
+
+def test_snapshot_rebuilds_sheets_with_new_settings(tmp_path):
+    wb = board_pack(tmp_path / "first.xlsx", streaming=False)
+    wb.build(quiet=True, snapshot=True)
+    again = wb.snapshot.workbook(str(tmp_path / "again.xlsx"))
+    css = again.css
+    again.sheetnames["sheet0"].row_style(30, css.grey, row=0)
+    again.sheetnames["sheet1"].set_column(8, 8, 40, again.get_format("grey"))
+    again.sheetnames["sheet2"].column_rule(1, css.bold, ">", 5)
+    again.build(quiet=True)
+    reused = [s for s, name in again.stats.counts if name == "reused"]
+    assert reused == ["sheet3"]
+    book = ZipFile(again.filename)
+    xml = book.read("xl/worksheets/sheet1.xml").decode()
+    assert 'customFormat="1" ht="30"' in xml
+    xml = book.read("xl/worksheets/sheet2.xml").decode()
+    grey = css.grey.format._get_xf_index()
+    assert f'<col min="9" max="9" width="40.7109375" style="{grey}"' in xml
+    xml = book.read("xl/worksheets/sheet3.xml").decode()
+    assert "<conditionalFormatting" in xml
@@ -1,7 +1,13 @@
+import re
+import tracemalloc
 import pytest
+from array import array
 from datetime import date
+from zipfile import ZipFile
 from xlmaker.workbook import XlWorkbook
 from xlmaker.examples.simple_stylesheet import SimpleStyleSheet
+from xlmaker import errors
+from xlmaker.errors import RowFlushedError
 
 
 @pytest.fixture
@@ -18,3 +24,552 @@ def test_overlap_format_range_has_same_format_object(wb_ws_css):
     ws.format_range(0, 1, 7, 2, css.grey)
     wb.build()
     assert ws.get_cell(1, 1).style.format is ws.get_cell(5, 2).style.format
+
+
+@pytest.fixture
+def wb_ws_table(tmp_path):
+    css = SimpleStyleSheet()
+    wb = XlWorkbook(
+        filename=str(tmp_path / "block.xlsx"),
+        options={"constant_memory": False},
+        stylesheet=css,
+    )
+    ws = wb.add_worksheet("test1")
+    return wb, ws, css
+
+
+def test_write_block_rows(wb_ws_table):
+    wb, ws, css = wb_ws_table
+    ws.write_block([[1, "a"], [2, "b"], [3]], row=2, col=1,
+        col_styles=[css.date, None], data_types=["number", "str"])
+    wb.build()
+    assert ws.table[2][1].number == 1
+    assert ws.table[3][2].string is not None
+    assert ws.table[4][1].format is css.date.format
+    assert ws._row == 5
+
+
+def test_write_block_style_list_combines_like_cell(wb_ws_table):
+    wb, ws, css = wb_ws_table
+    ws.write_block([[1, 2]], row=0, col=0, style=["bold", "date"],
+                   col_styles=[None, "grey"])
+    ws.cell(3, ["bold", "date"], row=0, col=2)
+    wb.build()
+    first, second = ws.table[0][0].format, ws.table[0][1].format
+    assert first is ws.table[0][2].format
+    assert first.bold and first.num_format == "m/d/yy"
+    assert second.bold and second.fg_color == "#D9D9D9"
+
+
+def test_ranges_and_blocks_layer_in_the_order_written(wb_ws_table):
+    wb, ws, css = wb_ws_table
+    ws.format_range(0, 0, 0, 1, css.date)
+    ws.cell(1, css.mmm_yy, row=0, col=0)
+    ws.write_block([[2]], row=0, col=1, style=css.mmm_yy)
+    ws.format_cell(0, 1, css.bold)
+    ws.write_block([[3, 4]], row=2, col=0, style=css.mmm_yy)
+    ws.format_range(2, 0, 2, 1, css.date)
+    ws.cell(5, css.bold, row=2, col=1)
+    wb.build()
+    first, second = ws.table[0][0].format, ws.table[0][1].format
+    assert first.num_format == second.num_format == "mmm yy;@"
+    assert second.bold and not first.bold
+    first, second = ws.table[2][0].format, ws.table[2][1].format
+    assert first.num_format == second.num_format == "m/d/yy"
+    assert second.bold and ws.table[2][1].number == 5
+
+
+def test_set_value_copies_the_callers_column(wb_ws_table):
+    wb, ws, css = wb_ws_table
+    cols = [["a", "b"], [1, 2]]
+    block = ws.write_block(cols, row=0, col=0, orient="columns")
+    ws.set_value(1, 1, 99)
+    ws.set_value(0, 1, 98)
+    assert cols == [["a", "b"], [1, 2]]
+    assert block.columns[1] == [98, 99]
+    wb.build()
+    assert ws.table[1][1].number == 99
+
+
+def test_write_block_columns_and_buffer(wb_ws_table):
+    wb, ws, css = wb_ws_table
+    ws.write_block([[1, 2, 3], [4, 5, 6]], row=0, col=0, orient="columns")
+    block = ws.write_block(array("d", [1.5, 2.5]), row=0, col=3)
+    assert block.data_types == ["number"]
+    wb.build()
+    assert ws.table[2][1].number == 6
+    assert ws.table[1][3].number == 2.5
+
+
+def test_cell_over_block_extends_column_style(wb_ws_table):
+    wb, ws, css = wb_ws_table
+    ws.write_block([[1, 2], [3, 4]], row=0, col=0, style=css.date)
+    ws.format_cell(1, 1, css.bold)
+    wb.build()
+    fmt = ws.table[1][1].format
+    assert ws.table[1][1].number == 4
+    assert fmt.bold and fmt.num_format == "m/d/yy"
+
+
+def test_streaming_flushes_finished_rows(tmp_path):
+    css = SimpleStyleSheet()
+    wb = XlWorkbook(filename=str(tmp_path / "stream.xlsx"), stylesheet=css)
+    ws = wb.add_worksheet("test1")
+    ws.streaming = True
+    ws.stream_window = 1
+    for i in range(100):
+        ws.number(i, css.bold)
+        ws.string(f"row{i}")
+        ws.next_row()
+        assert len(ws._cells) <= 2
+    ws.format_cell(99, 0, css.grey)
+    with pytest.raises(RowFlushedError):
+        ws.cell(1, row=5, col=0)
+    wb.build()
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet1.xml").decode()
+    assert '<c r="A100"' in xml
+    assert "row99" in xml and "row0" in xml
+
+
+def test_format_range_records_overlay_not_cells(wb_ws_table):
+    wb, ws, css = wb_ws_table
+    ws.format_range(0, 0, 499, 49, css.grey)
+    assert len(ws._cells) == 0
+    ws.cell(1, css.bold, row=10, col=10)
+    assert ws.get_cell(10, 10).style is css.combine(css.grey, css.bold)
+    wb.build()
+    assert ws.table[499][49].format is css.grey.format
+    assert ws.table[10][10].format.bold
+
+
+def test_format_range_extends_existing_cells_and_blocks(wb_ws_table):
+    wb, ws, css = wb_ws_table
+    ws.cell(1, css.bold, row=0, col=0)
+    ws.write_block([[1, 2]], row=1, col=0, style=css.date)
+    ws.format_range(0, 0, 1, 0, css.grey)
+    wb.build()
+    assert ws.table[0][0].format is css.combine(css.bold, css.grey).format
+    assert ws.table[1][0].format is css.combine(css.date, css.grey).format
+    assert ws.table[1][1].format is css.date.format
+
+
+def test_box_uses_edge_overlays(wb_ws_table):
+    wb, ws, css = wb_ws_table
+    ws.box(1, 1, 40, 20)
+    assert len(ws._overlays) == 8
+    assert len(ws._cells) == 0
+    ws.box(50, 1, 50, 1, bg_color="#D9D9D9")
+    wb.build()
+    corner = ws.table[1][1].format
+    assert (corner.top, corner.left, corner.bottom, corner.right) == (1, 1, 0, 0)
+    assert ws.table[20][20].format.right == 1
+    assert 10 not in ws.table[20]
+    single = ws.table[50][1].format
+    assert (single.top, single.left, single.bottom, single.right) == (1, 1, 1, 1)
+
+
+def test_box_styles_are_shared(wb_ws_table):
+    wb, ws, css = wb_ws_table
+    ws.box(0, 0, 3, 3, bg_color="#D9D9D9")
+    ws.box(10, 0, 30, 8, bg_color="#D9D9D9")
+    styles = {id(o.style) for o in ws._overlays}
+    assert len(ws._overlays) == 18
+    assert len(styles) == 9
+    plain = css.box_style("tl")
+    grey = css.box_style("tl", bg_color="#D9D9D9")
+    assert plain.name == "box_tl_1_black"
+    assert grey.name == "box_tl_1_black_bg_color_#D9D9D9"
+    assert css.box_style("", pattern=1, fg_color="red").name == \
+        "box_fill_1_black_pattern_1_fg_color_red"
+
+
+def test_write_frame_maps_dtypes(tmp_path):
+    pd = pytest.importorskip("pandas")
+    wb = XlWorkbook(
+        filename=str(tmp_path / "frame.xlsx"),
+        options={"constant_memory": False},
+    )
+    ws = wb.add_worksheet("frame")
+    css = wb.css
+    frame = pd.DataFrame(
+        {
+            "amount": [1.5, float("nan"), 3.0],
+            "count": [1, 2, 3],
+            "month": pd.to_datetime(["2024-01-01", "2024-02-01", None]),
+            "day": pd.to_datetime(["2024-01-05", "2024-02-01", "2024-03-01"]),
+            "name": ["a", None, "c"],
+        },
+        index=pd.Index(["x", "y", "z"], name="key"),
+    )
+    block = ws.write_frame(frame, index=True, header_style="bold")
+    assert block.data_types == ["str", "number", "number", "number",
+                                "number", "str"]
+    assert block.styles[3] is css.mmmm_yy and block.styles[4] is css.date
+    assert ws.get_cell(0, 0).value == "key"
+    assert ws._row == 4
+    wb.build()
+    assert ws.table[1][3].number == 45292
+    assert ws.table[2][1].format is css.default.format
+    assert ws.table[1][4].format is css.date.format
+
+
+class DuckColumn:
+    def __init__(self, values):
+        self.values = values
+
+    def to_numpy(self):
+        return self.values
+
+
+class DuckTable:
+    """Just the parts of an Arrow table that write_frame() reads."""
+
+    def __init__(self, **columns):
+        self.column_names = list(columns)
+        self._columns = list(columns.values())
+
+    def column(self, j):
+        return DuckColumn(self._columns[j])
+
+
+def test_write_frame_dates_from_duck_typed_table(tmp_path):
+    np = pytest.importorskip("numpy")
+    wb = XlWorkbook(
+        filename=str(tmp_path / "duck.xlsx"),
+        options={"constant_memory": False},
+    )
+    ws = wb.add_worksheet("duck")
+    css = wb.css
+    table = DuckTable(
+        month=np.array(["2024-01-01", "2024-02-01", "NaT"],
+                       dtype="datetime64[ns]"),
+        day=np.array(["1900-01-01", "1900-03-01", "2024-03-05"],
+                     dtype="datetime64[D]"),
+        count=np.array([1, 2, 3]),
+        amount=np.array([1.5, np.nan, 3.0]),
+        name=np.array(["a", "b", "c"]),
+    )
+    block = ws.write_frame(table, header_style="bold")
+    assert block.data_types == ["number"] * 4 + ["str"]
+    assert block.styles[0] is css.mmmm_yy and block.styles[1] is css.date
+    assert block.columns[0] == [45292.0, 45323.0, None]
+    assert block.columns[1].tolist() == [0.0, 61.0, 45356.0]
+    assert block.columns[3] == [1.5, None, 3.0]
+    wb.build()
+    assert ws.table[0][0].string is not None
+    assert ws.table[1][0].number == 45292
+    assert ws.table[1][0].format is css.mmmm_yy.format
+    assert ws.table[2][1].format is css.date.format
+    assert ws.table[3][2].number == 3
+
+
+def test_write_frame_arrow_table(wb_ws_table):
+    pa = pytest.importorskip("pyarrow")
+    wb, ws, css = wb_ws_table
+    table = pa.table({"n": [1, 2], "s": ["a", "b"]})
+    block = ws.write_frame(table, header=False, col_styles=[css.bold, None])
+    assert block.data_types == ["number", "str"]
+    assert block.styles[0] is css.bold
+
+
+def test_trusted_types_skip_value_checks(wb_ws_table):
+    wb, ws, css = wb_ws_table
+    checked = wb.add_worksheet("test2")
+    ws.trusted_types = True
+    for sheet in (ws, checked):
+        sheet.cell("=A1", row=0, col=0)
+        sheet.cell(5, row=0, col=1)
+        sheet.write_block([["=B1", 2.5]], row=1, col=0)
+    wb.build()
+    assert type(ws.table[0][0]).__name__ == "String"
+    assert type(ws.table[1][0]).__name__ == "String"
+    assert ws.table[0][1].number == 5 and ws.table[1][1].number == 2.5
+    assert type(checked.table[0][0]).__name__ == "Formula"
+    assert type(checked.table[1][0]).__name__ == "Formula"
+
+
+def test_formula_template_moves_relative_references():
+    from xlmaker.formula import FormulaTemplate
+    template = FormulaTemplate("='Q1 2024'!A1+$A2+A$3+SUM(B1:B9)&\"C5\"")
+    assert template.render() == template.formula
+    assert template.render(2, 1) == (
+        "='Q1 2024'!B3+$A4+B$3+SUM(C3:C11)&\"C5\""
+    )
+    assert FormulaTemplate("=a1*2").render(3) == "=A4*2"
+    template = FormulaTemplate("=SUM(A:A)+SUM($b:c)+SUM(2:3)+$1:$1+XFE1")
+    assert template.render(1, 1) == (
+        "=SUM(B:B)+SUM($B:D)+SUM(3:4)+$1:$1+XFE1"
+    )
+
+
+def test_fill_down_writes_one_shared_formula(tmp_path):
+    wb = XlWorkbook(filename=str(tmp_path / "fill.xlsx"))
+    ws = wb.add_worksheet("calc")
+    ws.fill_down("=A1*$B$1", 1000, row=0, col=2)
+    ws.fill_right("=C1-D1", 3, row=0, col=5, shared=False)
+    ws.fill_down("=A1", 3, row=0, col=9)
+    assert ws._row == 3
+    ws.cell(5, row=0, col=9)
+    wb.build(quiet=True)
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet1.xml").decode()
+    assert '<f t="shared" ref="C1:C1000" si="0">A1*$B$1</f>' in xml
+    assert xml.count('<f t="shared" si="0"/>') == 999
+    assert "<f>D1-E1</f>" in xml and "<f>E1-F1</f>" in xml
+    assert '<c r="J1" t="n"' not in xml and "<f>A2</f>" in xml
+
+
+def test_total_helpers_fill_shared_formulas(tmp_path):
+    wb = XlWorkbook(filename=str(tmp_path / "totals.xlsx"))
+    ws = wb.add_worksheet("calc")
+    ws.htotal(3, row=0, col=3, num_rows=50)
+    ws.vtotal(50, row=50, col=0, num_cols=4)
+    ws.cell(1, row=51, col=2)
+    ws.hvariance(-1, -2, num_rows=50)
+    ws.fill_right("=SUM(a:a)", 2, row=60, col=0, shared=False)
+    wb.build(quiet=True)
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet1.xml").decode()
+    assert '<f t="shared" ref="D1:D50" si="0">SUM(A1:C1)</f>' in xml
+    assert '<f t="shared" ref="A51:D51" si="1">SUM(A1:A50)</f>' in xml
+    assert '<f t="shared" ref="D52:D101" si="2">C52-B52</f>' in xml
+    assert "<f>SUM(A:A)</f>" in xml and "<f>SUM(B:B)</f>" in xml
+
+
+def test_row_and_column_default_styles(tmp_path):
+    css = SimpleStyleSheet()
+    wb = XlWorkbook(filename=str(tmp_path / "bands.xlsx"), stylesheet=css)
+    ws = wb.add_worksheet("bands")
+    ws.layer_row_styles = True
+    ws.set_column(2, 2, 20)
+    ws.col_style(css.grey, 2)
+    ws.row_style(15, css.bold, row=0)
+    ws.row_style(20, css.bold, row=0)
+    for r in range(4):
+        ws.cell(r, row=r, col=2)
+    ws.cell("x", css.date, row=3, col=2)
+    ws.write_block([[1, 2]], row=5, col=1)
+    wb.build(quiet=True)
+    assert len(ws._rows) == 1 and ws.set_rows[0][0] == 20
+    grey = css.grey.format._get_xf_index()
+    bold_grey = css.combine(css.grey, css.bold).format._get_xf_index()
+    date_grey = css.combine(css.grey, css.date).format._get_xf_index()
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet1.xml").decode()
+    assert f'<col min="3" max="3" width="20.7109375" style="{grey}"' in xml
+    assert f'<c r="C1" s="{bold_grey}"' in xml
+    assert f'<c r="C2" s="{grey}"' in xml
+    assert f'<c r="C4" s="{date_grey}"' in xml
+    assert f'<c r="C6" s="{grey}"' in xml
+
+
+def test_column_style_inside_wider_set_column(tmp_path):
+    css = SimpleStyleSheet()
+    wb = XlWorkbook(filename=str(tmp_path / "cols.xlsx"), stylesheet=css)
+    ws = wb.add_worksheet("cols")
+    ws.set_column(0, 5, 30, options={"level": 1})
+    ws.col_style(css.grey, 2, 3)
+    ws.col_style(css.bold, 5, 6)
+    ws.cell("x")
+    wb.build(quiet=True)
+    grey = css.grey.format._get_xf_index()
+    bold = css.bold.format._get_xf_index()
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet1.xml").decode()
+    cols = re.findall(r"<col [^>]*/>", xml)
+    assert cols == [
+        '<col min="1" max="2" width="30.7109375" customWidth="1" '
+        'outlineLevel="1"/>',
+        f'<col min="3" max="4" width="30.7109375" style="{grey}" '
+        'customWidth="1" outlineLevel="1"/>',
+        '<col min="5" max="5" width="30.7109375" customWidth="1" '
+        'outlineLevel="1"/>',
+        f'<col min="6" max="6" width="30.7109375" style="{bold}" '
+        'customWidth="1" outlineLevel="1"/>',
+        f'<col min="7" max="7" width="9.140625" style="{bold}"/>',
+    ]
+
+
+def test_row_style_is_replaced_by_cell_styles(tmp_path):
+    css = SimpleStyleSheet()
+    wb = XlWorkbook(filename=str(tmp_path / "rows.xlsx"), stylesheet=css)
+    ws = wb.add_worksheet("rows")
+    ws.row_style(15, css.bold, row=0)
+    ws.number(1, css.date)
+    layered = wb.add_worksheet("layered")
+    layered.layer_row_styles = True
+    layered.row_style(15, css.bold, row=0)
+    layered.number(2, css.date)
+    wb.build(quiet=True)
+    date = css.date.format._get_xf_index()
+    bold_date = css.combine(css.date, css.bold).format._get_xf_index()
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet1.xml").decode()
+    assert f'<c r="A1" s="{date}"' in xml
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet2.xml").decode()
+    assert f'<c r="A1" s="{bold_date}"' in xml
+
+
+def test_column_styles_in_parallel_build(tmp_path):
+    def build(name, workers):
+        css = SimpleStyleSheet()
+        wb = XlWorkbook(filename=str(tmp_path / name), stylesheet=css)
+        for s in range(2):
+            ws = wb.add_worksheet(f"s{s}")
+            ws.number(1, ["bold", "mmm_yy"])
+            ws.col_style(css.grey, 1)  # no cell uses the column format
+        wb.build(workers=workers, quiet=True)
+        return wb, css
+
+    serial, _ = build("serial.xlsx", 1)
+    parallel, css = build("parallel.xlsx", 2)
+    for sheet in ("sheet1", "sheet2"):
+        xml = ZipFile(parallel.filename).read(
+            f"xl/worksheets/{sheet}.xml").decode()
+        style = int(re.search(r'<col min="2" max="2"[^>]* style="(\d+)"',
+                              xml).group(1))
+        xf = parallel.xf_formats[style]
+        assert xf.fg_color == "#D9D9D9"  # a solid fill's colour
+        assert not xf.bold and xf.num_format == "General"
+    a, b = ZipFile(serial.filename), ZipFile(parallel.filename)
+    for name in a.namelist():
+        if name != "docProps/core.xml":
+            assert a.read(name) == b.read(name), name
+
+
+def test_merge_writes_in_row_order_and_drops_covered_cells(tmp_path):
+    css = SimpleStyleSheet()
+    wb = XlWorkbook(filename=str(tmp_path / "merge.xlsx"), stylesheet=css)
+    ws = wb.add_worksheet("merge")
+    ws.streaming = True
+    ws.cell("Title", css.bold, row=0, col=0)
+    ws.cell("hidden", row=1, col=1)
+    ws.merge_cells(0, 0, 1, 3, style=css.grey)
+    ws.cell("right", row=0, col=4)
+    ws.cell("below", row=1, col=4)
+    ws.cell("covered", row=1, col=2)
+    assert ws.get_merge(1, 3).value == "Title" and ws.get_merge(2, 0) is None
+    with pytest.raises(errors.OverlappingMergeError):
+        ws.merge_cells(1, 3, 2, 5)
+    ws.merge_cells(2, 0, 2, 1, 5, css.date)
+    ws.next_row(3)
+    wb.build(quiet=True)
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet1.xml").decode()
+    assert '<mergeCell ref="A1:D2"/>' in xml
+    assert '<mergeCell ref="A3:B3"/>' in xml
+    assert xml.index('r="D2"') < xml.index('r="E2"')
+    assert "hidden" not in xml and "covered" not in xml
+    assert xml.count('<c r="') == 2 * 4 + 2 + 2
+
+
+def test_writes_inside_a_merge_go_to_its_value(tmp_path):
+    css = SimpleStyleSheet()
+    wb = XlWorkbook(filename=str(tmp_path / "merged.xlsx"), stylesheet=css)
+    ws = wb.add_worksheet("merged")
+    ws.merge_cells(0, 0, 1, 2, "Old")
+    ws.merge_cells(4, 1, 4, 2)
+    assert ws.cell("New", css.bold, row=0, col=0) is ws.get_merge(0, 0)
+    assert ws.cell("covered", row=1, col=1) is None
+    ws.write_block([[1, 2], [3, "block"]], row=3, col=0)
+    assert len(ws._cells) == 0
+    assert ws.get_merge(0, 0).style is css.bold
+    assert ws.get_merge(4, 1).value == "block"
+    wb.build(quiet=True)
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet1.xml").decode()
+    assert "New" in xml and "block" in xml
+    assert "Old" not in xml and "covered" not in xml
+
+
+def test_style_rules_test_each_column_once(tmp_path):
+    css = SimpleStyleSheet()
+    wb = XlWorkbook(filename=str(tmp_path / "rules.xlsx"), stylesheet=css)
+    ws = wb.add_worksheet("rules")
+    ws.write_block([[1, -2], [-3, 4], [5, 0]], row=1, col=0)
+    ws.number(-7, row=2, col=1)
+    calls = []
+
+    def negative(values):
+        calls.append(list(values))
+        return [v < 0 for v in values]
+
+    ws.column_rule(0, css.bold, negative, first_row=1, last_col=1,
+                   vectorized=True)
+    ws.style_rule(1, 0, 3, 1, css.grey, "between", (4, 6), key_col=0,
+                  native=False)
+    ws.column_rule(1, css.tableheader, "==", 0, first_row=1)
+    wb.build(quiet=True)
+    assert calls == [[1, -3, 5], [-7], [-2, 4, 0]]
+    bold = css.bold.format._get_xf_index()
+    grey = css.grey.format._get_xf_index()
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet1.xml").decode()
+    for ref in ("B2", "A3", "B3"):
+        assert f'<c r="{ref}" s="{bold}"' in xml
+    for ref in ("A4", "B4"):
+        assert f'<c r="{ref}" s="{grey}"' in xml
+    assert '<conditionalFormatting sqref="B2:B4">' in xml
+    assert 'operator="equal"><formula>0</formula>' in xml
+
+
+def test_rule_hits_in_blocks_store_no_cells(tmp_path):
+    css = SimpleStyleSheet()
+    wb = XlWorkbook(filename=str(tmp_path / "hits.xlsx"), stylesheet=css)
+    ws = wb.add_worksheet("hits")
+    ws.write_block([[i, -i] for i in range(20000)], style=css.date)
+    ws.style_rule(0, 0, None, 1, css.bold, lambda value: value > 0)
+    ws.column_rule(0, css.grey, ">", 10, first_row=0)
+    ws.column_rule(1, css.grey, "<", -10, first_row=0)
+    wb.build(quiet=True)
+    assert len(ws._cells) == 0
+    bold_date = css.combine(css.date, css.bold).format._get_xf_index()
+    date = css.date.format._get_xf_index()
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet1.xml").decode()
+    assert f'<c r="A2" s="{bold_date}"' in xml
+    assert f'<c r="B2" s="{date}"' in xml
+    key = css.grey.format._get_format_key()
+    assert [f._get_format_key() for f in wb.formats].count(key) == 1
+
+
+def test_write_rows_reads_cursor_in_batches(tmp_path):
+    import sqlite3
+    db = sqlite3.connect(":memory:")
+    db.execute("create table sales (region text, amount real)")
+    db.executemany("insert into sales values (?, ?)",
+                   [(f"r{i % 7}", i * 1.5) for i in range(2500)])
+    wb = XlWorkbook(filename=str(tmp_path / "sales.xlsx"))
+    ws = wb.add_worksheet("sales")
+    ws.streaming = True
+    held = []
+
+    class Cursor:
+        def __init__(self, cursor):
+            self.cursor = cursor
+            self.description = cursor.description
+
+        def fetchmany(self, size):
+            held.append(sum(block.num_rows for block in ws._blocks))
+            return self.cursor.fetchmany(size)
+
+    cursor = Cursor(db.execute("select region, amount from sales"))
+    count = ws.write_rows(cursor, col_styles=[None, "bold"],
+                          data_types=["str", "number"], header=True,
+                          header_style="bold", batch_size=1000)
+    assert count == 2500 and ws._row == 2501
+    assert len(held) == 4 and max(held) <= 1000
+    assert len(ws._cells) == 0  # the header row was streamed too
+    assert ws.write_rows(iter([("a", "b"), ("x", 1)]), header=True) == 1
+    wb.build(quiet=True)
+    xml = ZipFile(wb.filename).read("xl/worksheets/sheet1.xml").decode()
+    assert '<c r="B2501"' in xml and '<v>3748.5</v>' in xml
+    assert '<c r="A2503"' in xml
+
+
+def test_write_rows_memory_does_not_grow_with_rows(tmp_path):
+    def peak(count):
+        wb = XlWorkbook(filename=str(tmp_path / f"rows{count}.xlsx"))
+        ws = wb.add_worksheet("rows")
+        ws.streaming = True
+        rows = ((f"customer {i}", i * 1.5) for i in range(count))
+        tracemalloc.start()
+        try:
+            ws.write_rows(rows, batch_size=500)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            wb.build(quiet=True)
+
+    assert peak(10000) < 2 * peak(1000)
@@ -1,15 +1,34 @@
+import logging
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from xlsxwriter.workbook import Workbook
 from xlsxwriter.chartsheet import Chartsheet
 from .worksheet import XlWorksheet
-from .stylesheet import StyleSheet
+from .stylesheet import StyleSheet, CompiledStyleSheet
+from .parallel import FormatFactory, build_worksheet, renumber_formats, \
+    state_formats, register_cell_tuples
+from .stats import BuildStats
+from .stringpool import StringPool
+from .snapshot import WorkbookSnapshot, capture_rows
 from . import errors
 
+log = logging.getLogger(__name__)
+
 
 class XlWorkbook(Workbook):
     chartsheet_class = Chartsheet
     worksheet_class = XlWorksheet
     stylesheet_class = StyleSheet
+    stats_class = BuildStats
+    build_workers = 1  # processes build() uses for worksheets
+    quiet = False  # don't print the file name after build()
+    memory_budget = None  # bytes of cells kept in memory before spilling
+    memory_low_water = 0.75  # share of the budget left after a spill
+    snapshot = None  # WorkbookSnapshot of the last build(snapshot=True)
+    _snapshot = None  # WorkbookSnapshot this workbook was restored from
+    _snapshot_formats = None
     default_opt = {
         'constant_memory': True,
         'default_date_format': 'dd/mm/yy',
@@ -26,14 +45,27 @@ class XlWorkbook(Workbook):
         properties=None,
         stylesheet=None,
     ):
-        if filename[-5:] != '.xlsx':
-            filename = filename + '.xlsx'
+        # filename may also be a file-like object such as io.BytesIO.
+        if isinstance(filename, (str, os.PathLike)):
+            filename = os.fspath(filename)
+            if filename[-5:] != '.xlsx':
+                filename = filename + '.xlsx'
         options = options or {}
         options = {**self.default_opt, **options}
+        self.init_options = options
         super().__init__(filename=filename, options=options)
+        self.stats = self.stats_class()
+        self.strings = StringPool()
         properties = properties or {}
         properties = {**self.default_props, **properties}
         self.set_properties(properties)
+        # A compiled stylesheet gives a fresh sheet.
+        if isinstance(stylesheet, (str, os.PathLike)):
+            raise TypeError(
+                "Pass a saved stylesheet as CompiledStyleSheet.load(path)."
+            )
+        if isinstance(stylesheet, CompiledStyleSheet):
+            stylesheet = stylesheet.stylesheet()
         if isinstance(stylesheet, StyleSheet):
             self.css = stylesheet
         else:
@@ -52,6 +84,7 @@ class XlWorkbook(Workbook):
         ws.set_zoom(90)
         ws.set_print_scale(85)
         ws.set_stylesheet(self.css)
+        ws._workbook = self
         return ws
 
     def add_sheet(self, worksheet:XlWorksheet, name=None):
@@ -86,6 +119,7 @@ class XlWorkbook(Workbook):
         self.worksheets_objs.append(worksheet)
         self.sheetnames[name] = worksheet
         worksheet.set_stylesheet(self.css)
+        worksheet._workbook = self
         return worksheet
 
     def h_sheet(self, *args, **kwargs):
@@ -109,13 +143,232 @@ class XlWorkbook(Workbook):
         for name, style in self.css.get_styles():
             self.css.name = self.add_format(style.get_properties())
 
-    def build(self):
-        filepath = Path(self.filename).resolve().parent
-        filepath.mkdir(parents=True, exist_ok=True)
+    def build(self, workers=None, quiet=None, executor=None, snapshot=False):
+        """Write every worksheet and save the workbook.
+
+        With more than one worker and the constant_memory option, sheets
+        are built in a process pool and the file is identical to a serial
+        build. Otherwise they are built one by one. Timings and counts
+        are recorded in self.stats; quiet (or the quiet attribute) stops
+        the file name being printed.
+
+        With an executor the build is submitted to it and the future is
+        returned straight away; the workbook must not be changed until the
+        future is done. Use a thread pool, as a process would build a copy.
+
+        With snapshot, self.snapshot is set to a WorkbookSnapshot for
+        building the workbook again with new values. Sheets of a workbook
+        restored from a snapshot whose layout_key() hasn't changed reuse
+        their captured rows.
+        """
+        if executor is not None:
+            return executor.submit(
+                self.build, workers, quiet, snapshot=snapshot
+            )
+        if self._is_path():
+            filepath = Path(self.filename).resolve().parent
+            filepath.mkdir(parents=True, exist_ok=True)
+        workers = workers or self.build_workers
+        rows = None
+        if snapshot:
+            rows, models = self._snapshot_models()
+        with self.stats.timer('build'):
+            if (workers > 1 and self.constant_memory and
+                    len(self.worksheets_objs) > 1):
+                self._build_parallel(workers, rows)
+            else:
+                for ws in self.worksheets_objs:
+                    self._build_sheet(ws, rows)
+            for ws in self.worksheets_objs:
+                if isinstance(ws, XlWorksheet):
+                    ws.add_rule_formats(self)
+            with self.stats.timer('close'):
+                self.close()
+        if snapshot:
+            self.snapshot = WorkbookSnapshot(self, models, rows)
+        self._count_build()
+        if not self._is_path():
+            log.info("Workbook written to %r", self.filename)
+            return self.filename
+        path = Path(self.filename).resolve()
+        log.info("File created: %s", path)
+        if not (self.quiet if quiet is None else quiet):
+            print("File created: ", path)
+        return path
+
+    def build_async(self, workers=None, quiet=None, executor=None):
+        """Run build() on another thread and return its future.
+
+        The future's result is the file path, or the file object the
+        workbook was created with, e.g. an io.BytesIO.
+        """
+        if executor is not None:
+            return self.build(workers, quiet, executor)
+        pool = ThreadPoolExecutor(max_workers=1)
+        future = pool.submit(self.build, workers, quiet)
+        pool.shutdown(wait=False)  # the thread exits once the build is done
+        return future
+
+    def close(self):
+        """Save the workbook and delete the sheets' spill files."""
+        try:
+            return super().close()
+        finally:
+            for ws in self.worksheets_objs:
+                if isinstance(ws, XlWorksheet):
+                    ws._cells.close()
+
+    def discard(self):
+        """Close the workbook without saving it, e.g. after a failed build.
+
+        The sheets' temporary files are deleted, and so is the file at
+        filename if the build got as far as writing it.
+        """
+        for ws in self.worksheets_objs:
+            if getattr(ws, 'row_data_filename', None):
+                ws._opt_close()
+                if os.path.exists(ws.row_data_filename):
+                    os.remove(ws.row_data_filename)
+            if isinstance(ws, XlWorksheet):
+                ws._cells.close()
+        self.fileclosed = True
+        if self._is_path() and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def memory_usage(self):
+        """XlWorksheet.memory_usage() reports by sheet name."""
+        return {
+            ws.name: ws.memory_usage() for ws in self.worksheets_objs
+            if isinstance(ws, XlWorksheet)
+        }
+
+    def memory_bytes(self):
+        """Estimated bytes of cells held in memory by every sheet."""
+        return sum(
+            ws._cells.memory_usage()['bytes'] for ws in self.worksheets_objs
+            if isinstance(ws, XlWorksheet)
+        )
+
+    def _is_path(self):
+        return isinstance(self.filename, str)
+
+    def _snapshot_models(self):
+        """The sheets pickled before building, and their layout keys."""
+        if not self.constant_memory:
+            raise ValueError("Snapshots need the constant_memory option.")
+        rows = {}
         for ws in self.worksheets_objs:
+            if ws._flushed:
+                raise ValueError(
+                    f"{ws.name} has streamed rows and can't be captured."
+                )
+            rows[ws.name] = ws.layout_key()
+        models = pickle.dumps(
+            (self.css, self.worksheets_objs), pickle.HIGHEST_PROTOCOL
+        )
+        return rows, models
+
+    def _reusable(self, ws):
+        return (
+            ws._snapshot is not None and
+            ws._snapshot.key == ws.layout_key()
+        )
+
+    def _build_sheet(self, ws, rows=None):
+        """Build one sheet, or add its rows from a snapshot.
+
+        With rows (sheet name: layout key), its key is replaced by
+        (key, xml, state) for a new snapshot.
+        """
+        if self._reusable(ws):
+            xml, state = self._snapshot.restore_rows(ws, self)
+            self.stats.count('reused', 1, ws.name)
+        elif rows is not None:
+            xml, state = capture_rows(ws, self)
+        else:
             ws.build(self)
-        self.close()
-        print("File created: ", Path(self.filename).resolve())
+            return
+        if rows is not None:
+            rows[ws.name] = (rows[ws.name], xml, state)
+
+    def _adopt_format(self, fmt, index=True):
+        """Index a format made for another workbook in this one.
+
+        Without index the format only joins this workbook, to be numbered
+        when it is first written, and None is returned.
+        """
+        fmt.xf_format_indices = self.xf_format_indices
+        fmt.dxf_format_indices = self.dxf_format_indices
+        if not index:
+            if fmt.xf_index is None:
+                self.formats.append(fmt)
+            return None
+        fmt.xf_index = None
+        index = fmt._get_xf_index()
+        if fmt.xf_index is not None:
+            self.formats.append(fmt)
+        return index
+
+    def _count_build(self):
+        cache = self.css.combine_cache_info()
+        self.stats.count('styles', self.css.format_report()['styles'])
+        self.stats.count('formats', len(self.xf_format_indices))
+        self.stats.count('strings', len(self.strings))
+        self.stats.count('combine_hits', cache['hits'])
+        self.stats.count('combine_misses', cache['misses'])
+        if self._is_path():
+            size = os.path.getsize(self.filename)
+        elif hasattr(self.filename, 'getbuffer'):
+            size = self.filename.getbuffer().nbytes
+        else:
+            size = self.filename.tell()
+        self.stats.count('bytes', size)
+
+    def _build_parallel(self, workers, rows=None):
+        """Build worksheets in worker processes.
+
+        Each worker numbers the formats it creates after a snapshot of the
+        workbook's format indices. The workbook then renumbers them sheet
+        by sheet, in the order a serial build would have first used them.
+        """
+        register_cell_tuples()
+        factory = FormatFactory(
+            self.default_format_properties, self.excel2003_style,
+            self.xf_format_indices, self.dxf_format_indices,
+        )
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                None if self._reusable(ws) else
+                pool.submit(build_worksheet, ws, factory, rows is not None)
+                for ws in self.worksheets_objs
+            ]
+            for ws, future in zip(self.worksheets_objs, futures):
+                if future is None:
+                    self._build_sheet(ws, rows)
+                    continue
+                xml, formats, state, stats, style_formats = future.result()
+                self.stats.merge(stats)
+                indices = {}
+                for fmt in formats:
+                    local = fmt.xf_index
+                    indices[local] = self._adopt_format(fmt)
+                # Formats not yet written, such as column formats, are
+                # numbered by the packager in serial build order.
+                for fmt in state_formats(state):
+                    if fmt and fmt.xf_format_indices is not \
+                            self.xf_format_indices:
+                        self._adopt_format(fmt, index=False)
+                # The parent's styles get the formats, as after a serial
+                # build.
+                styles = self.css._by_id
+                for i, fmt in style_formats.items():
+                    if i < len(styles) and \
+                            fmt.xf_format_indices is self.xf_format_indices:
+                        self.css.adopt_format(styles[i], fmt)
+                xml = renumber_formats(xml, indices)
+                ws.add_built_rows(xml, state)
+                if rows is not None:
+                    rows[ws.name] = (rows[ws.name], xml, state)
 
     def get_format(self, name):
-        return self.css.get(name).get_format(self)
+        return self.css.build_style(self.css.get(name), self)
@@ -1,8 +1,18 @@
+import heapq
+from contextlib import nullcontext
 from xlsxwriter.worksheet import Worksheet, convert_cell_args, \
     convert_range_args, convert_column_args
 from xlsxwriter.utility import xl_rowcol_to_cell, \
-    xl_cell_to_rowcol, xl_range
-from .cell import Cell
+    xl_rowcol_to_cell_fast, xl_cell_to_rowcol, xl_range
+from .cell import Cell, write_cell, cell_writer
+from .cellstore import CellStore
+from .block import Block, to_columns, infer_data_type, per_column, \
+    iter_batches
+from .frame import frame_columns, convert_column
+from .formula import FormulaTemplate, FormulaBlock, SharedFormula
+from .overlay import OverlayIndex
+from .merge import MergeIndex
+from .rules import StyleRule
 from .style import Style
 from .stylesheet import StyleSheet
 from .row import Row
@@ -21,25 +31,77 @@ class XlWorksheet(Worksheet):
     frozen_cols = 0
     col_widths = None
     default_footer = ''
+    cell_store_class = CellStore
+    _streaming = False
+    stream_window = 0  # rows above the cursor that stay editable
+    trusted_types = False  # write values by data_type without checking them
+    batch_size = 1000  # rows write_rows() reads at a time
+    layer_row_styles = False  # cells extend their row_style() style
+    spill_window = 1000  # rows below the newest that never spill to disk
+    _snapshot = None  # SheetSnapshot this sheet was restored from
+    # style names for write_frame() columns, by kind of column
+    frame_styles = {
+        'number': None, 'date': 'date', 'month': 'mmmm_yy', 'str': None,
+    }
+    # xlsxwriter attributes a build changes, copied back from build workers
+    build_state = (
+        'dim_rowmin', 'dim_rowmax', 'dim_colmin', 'dim_colmax',
+        'previous_row', 'set_rows', 'row_sizes', 'row_size_changed',
+        'outline_row_level', 'hyperlinks', 'hlink_count', 'colinfo',
+        'col_sizes', 'col_formats', 'col_size_changed', 'outline_col_level',
+        'merge',
+    )
+
+    @property
+    def streaming(self):
+        """Write finished rows to the workbook as we go.
+
+        Turning it on releases the strings the sheet already holds from
+        the workbook's StringPool, since a streaming sheet doesn't pool
+        its strings.
+        """
+        return self._streaming
+
+    @streaming.setter
+    def streaming(self, streaming):
+        if streaming and not self._streaming:
+            strings = self._string_pool()
+            if strings is not None:
+                strings.release(self._string_values())
+        self._streaming = streaming
 
     def __init__(self, stylesheet=None, name=None, workbook=None, footer=None):
         super().__init__()
         self.footer = footer or self.default_footer
         self.css = stylesheet
         self.name = name
+        self._workbook = workbook
+        self._flushed = 0
+        self._writers = {}
+        self._shared_formulas = 0
+        self._changes = 0  # edits to the layout outside the cell store
+        self._layers = 0  # overlays and blocks added, to layer them in order
         if workbook is not None:
             workbook.add_sheet(self, name)
-        self._cells = {}
-        self._rows = []
-        self._merged = []
+        self._cells = self.cell_store_class()
+        self._cells.grow_hook = self._check_memory
+        self._blocks = []
+        self._overlays = OverlayIndex()
+        self._rows = {}  # Row settings by row number
+        self._col_styles = {}  # default style by column
+        self._col_ranges = []  # col_style() calls not yet sent to set_column
+        self._default_formats = {}
+        self._merges = MergeIndex()
+        self._rules = []  # StyleRules in the order they were added
         self._row = 0
         self._col = 0
         self._lastrow = 0
         self._lastcol = 0
-        self.setup_page_layout()
-        self.setup_header()
-        self.setup_footer()
-        self.setup_body()
+        with self._timer('setup'):
+            self.setup_page_layout()
+            self.setup_header()
+            self.setup_footer()
+            self.setup_body()
 
     def setup_page_layout(self):
         self.set_paper(self.paper)
@@ -67,6 +129,36 @@ class XlWorksheet(Worksheet):
     def setup_body(self):
         pass
 
+    def __getstate__(self):
+        # Sheets are pickled for build workers without the workbook and
+        # the open row data file.
+        state = self.__dict__.copy()
+        state.update(
+            _workbook=None, fh=None, row_data_fh=None, _writers={},
+            _default_formats={}, _snapshot=None,
+        )
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cells.grow_hook = self._check_memory
+
+    def cell_writer(self, data_type):
+        """The writer for a data_type, looked up once per sheet.
+
+        See cell.cell_writer(). With trusted_types, cells are assumed to
+        hold values of their data_type: only None is written as a blank,
+        and cells without a data_type are written by their Python type
+        without xlsxwriter's string checks or write handlers.
+        """
+        key = (data_type, self.trusted_types)
+        writer = self._writers.get(key)
+        if writer is None:
+            writer = self._writers[key] = cell_writer(
+                self, data_type, self.trusted_types
+            )
+        return writer
+
     def set_stylesheet(self, stylesheet: StyleSheet):
         self.css = stylesheet
         return self.css
@@ -75,6 +167,8 @@ class XlWorksheet(Worksheet):
         self._row += number
         if reset_column:
             self._col = 0
+        if self.streaming:
+            self.flush_rows(self._row - self.stream_window)
         return self._row
 
     def next_col(self, number=1):
@@ -85,8 +179,75 @@ class XlWorksheet(Worksheet):
         self._col = 0
     
     def get_cell(self, row:int, col:int) -> Cell:
-        location = xl_rowcol_to_cell(row, col)
-        return self._cells.get(location)
+        cell = self._cells.get(row, col)
+        if cell is None and len(self._overlays) and row >= self._flushed:
+            # Positions covered by format_range() exist once asked for.
+            style = self._overlaid_style(row, col)
+            if style is not None:
+                cell = self._cells.add(row, col, style=style)
+        return cell
+
+    def set_value(self, row, col, value):
+        """Replace the value at row, col, keeping its style and type.
+
+        The value is that of a cell, else of a block or merged range. An
+        unchanged value leaves the sheet as it was, so a sheet restored
+        from a snapshot can still reuse its captured rows.
+        """
+        self._check_row(row)
+        if type(value) is str:
+            strings = self._string_pool()
+            if strings is not None:
+                value = strings.intern(value)
+        cell = self._cells.get(row, col)
+        if cell is not None:
+            if cell.value != value:
+                cell.set_value(value)
+            return
+        for block in reversed(self._blocks):
+            if block.covers(row, col):
+                column = block.columns[col - block.col]
+                i = row - block.row
+                if isinstance(block, FormulaBlock):
+                    raise TypeError(
+                        f"Row {row}, col {col} of {self.name} holds a "
+                        f"filled formula."
+                    )
+                if i >= len(column) or column[i] != value:
+                    column = block.writable_column(col)
+                    column.extend([None] * (i + 1 - len(column)))
+                    column[i] = value
+                    self._changes += 1
+                return
+        merge = self._merges.find(row, col)
+        if merge is not None and (merge.row1, merge.col1) == (row, col):
+            if merge.value != value:
+                merge.value = value
+                self._changes += 1
+            return
+        raise KeyError(f"No value at row {row}, col {col} of {self.name}.")
+
+    def layout_key(self):
+        """Changes whenever cells, values, blocks, ranges, rules or row
+        and column settings are added or edited.
+
+        Settings made with xlsxwriter's set_row() and set_column() are
+        keyed on their content, as a snapshot restores its own.
+        """
+        def fmt_key(fmt):
+            return fmt._get_format_key() if fmt else None
+
+        return (
+            self._cells.version, self._changes,
+            tuple(sorted(
+                (key, tuple(info[:3]), fmt_key(info[3]), tuple(info[4:]))
+                for key, info in self.colinfo.items()
+            )),
+            tuple(sorted(
+                (row, options[0], fmt_key(options[1]), tuple(options[2:]))
+                for row, options in self.set_rows.items()
+            )),
+        )
 
     def string(self, value, style=None, row=None, col=None):
         return self.cell(value, style=style, data_type="str", row=row, col=col)
@@ -97,43 +258,303 @@ class XlWorksheet(Worksheet):
     def cell(self, value, style=None, data_type=None, row=None, col=None):
         row = row if row is not None else self._row
         col = col if col is not None else self._col
+        if row < self._flushed:
+            self._check_row(row)
         self._row = row
         self._col = col + 1
-        location = xl_rowcol_to_cell(row, col)
 
         style = self.get_style(style)
         if hasattr(value, "value"):
             value = value.value
+        if type(value) is str:
+            strings = self._string_pool()
+            if strings is not None:
+                value = strings.intern(value)
 
-        cell = self._cells.get(location)
+        if len(self._merges):
+            merge = self._merges.find(row, col)
+            if merge is not None:
+                return self._write_merged(merge, row, col, value, style,
+                                          data_type)
+        cell = self._cells.get(row, col)
         if cell is None:
-            cell = Cell(row, col, value, style, data_type)
-            self._cells[location] = cell
+            if len(self._overlays):
+                style = self._overlaid_style(row, col, style)
+            cell = self._cells.add(row, col, value, style, data_type)
         else:
             cell.set_value(value)
             cell.set_type(data_type)
-            existing_style = cell.style
-            if existing_style is None:
-                cell.style = style
-            else:
-                combined_style = existing_style + style
-                existing_combined_style = self.css.get(combined_style.name)
-                if existing_combined_style is None:
-                    cell.add_style(style)
-                else:
-                    cell.style = existing_combined_style
-        self.css.add(cell.style, exists_ok=True)
+            cell.style = self.css.combine(cell.style, style)
         return cell
-        # if location not in self._cells:
-        #     self._cells[location] = Cell(row, col, value, style, data_type)
-        # else:
-        #     self._cells[location].set_value(value)
-        #     self._cells[location].set_type(data_type)
-        #     if style is not None:
-        #         self._cells[location].add_style(style)
-        # if style is not None:
-        #     self.css.add(self._cells[location].style, exists_ok=True)
-        # return self._cells[location]
+
+    def write_block(
+        self, values, row=None, col=None, style=None, data_types=None,
+        orient="rows", col_styles=None
+    ):
+        """Write a 2-D range of values with its top-left corner at row, col.
+
+        values is a list of rows, a list of columns (orient="columns"), a
+        NumPy array or any object supporting the buffer protocol. style is
+        for every column and, as for cell(), a list of styles is combined.
+        col_styles is one style (or list to combine) per column, layered
+        over style. data_types is one type for every column or a list with
+        one entry per column. Each column's style is resolved once and the
+        values are kept as columns rather than as Cell objects.
+        """
+        row = row if row is not None else self._row
+        col = col if col is not None else self._col
+        self._check_row(row)
+        columns = to_columns(values, orient)
+        num_cols = len(columns)
+        col_styles = per_column(col_styles, num_cols, "col_styles")
+        if style is not None:
+            style = self.get_style(style)
+            col_styles = [
+                style if s is None else
+                self.css.combine(style, self.get_style(s))
+                for s in col_styles
+            ]
+        styles = [self.get_style(s) for s in col_styles]
+        data_types = [
+            data_type if data_type is not None else infer_data_type(column)
+            for column, data_type in zip(
+                columns, per_column(data_types, num_cols, "data_types")
+            )
+        ]
+        self._intern_columns(columns, data_types)
+        return self._add_block(Block(row, col, columns, styles, data_types))
+
+    def write_rows(
+        self, rows, row=None, col=None, col_styles=None, data_types=None,
+        header=False, header_style=None, batch_size=None,
+    ):
+        """Write rows from an iterable or a DB-API cursor, a batch at a time.
+
+        A cursor is read with fetchmany(batch_size), anything else
+        batch_size rows at a time. Each batch is added as a block, so no
+        Cell is made per value, and a streaming sheet writes and drops
+        finished batches as it goes: memory is bounded by the batch size,
+        not the result set. col_styles and data_types are as for
+        write_block() and are resolved once. With header, the cursor's
+        column names, or an iterable's first row, are written first with
+        header_style. Returns the number of rows written.
+        """
+        row = row if row is not None else self._row
+        col = col if col is not None else self._col
+        self._check_row(row)
+        header_style = self.get_style(header_style)
+
+        def write_header(names):
+            for j, name in enumerate(names):
+                self.cell(name, header_style, 'str', row=row, col=col + j)
+            return row + 1
+
+        if header and getattr(rows, "description", None) is not None:
+            row = write_header([d[0] for d in rows.description])
+            header = False
+        count = 0
+        for batch in iter_batches(rows, batch_size or self.batch_size):
+            if header:
+                row = write_header(batch[0])
+                batch = batch[1:]
+                header = False
+            if not batch:
+                continue
+            columns = to_columns(batch)
+            if count == 0:
+                num_cols = len(columns)
+                column_styles = [
+                    self.get_style(s)
+                    for s in per_column(col_styles, num_cols, "col_styles")
+                ]
+                data_types = per_column(data_types, num_cols, "data_types")
+            if len(columns) > num_cols:
+                raise ValueError(
+                    f"Expected rows of {num_cols} values, got {len(columns)}."
+                )
+            columns += [[] for _ in range(num_cols - len(columns))]
+            self._intern_columns(columns, data_types)
+            self._add_block(
+                Block(row + count, col, columns, column_styles, data_types)
+            )
+            count += len(batch)
+        if not count:
+            self._row, self._col = row, col
+        return count
+
+    def _intern_columns(self, columns, data_types):
+        strings = self._string_pool()
+        if strings is not None:
+            for j, (column, data_type) in enumerate(zip(columns, data_types)):
+                if data_type in ('str', None) and self._object_column(column):
+                    columns[j] = strings.intern_column(column)
+
+    @staticmethod
+    def _object_column(column):
+        """Whether a block column is a list or object array, which are the
+        columns that can hold strings."""
+        return isinstance(column, list) or \
+            getattr(getattr(column, "dtype", None), "kind", "") == "O"
+
+    def _add_block(self, block):
+        self._layers += 1
+        block.order = self._layers
+        for merge in self._merges:
+            if block.covers(merge.row1, merge.col1):
+                self._write_merged(
+                    merge, merge.row1, merge.col1,
+                    block.get_value(merge.row1, merge.col1),
+                    block.get_style(merge.col1), block.get_type(merge.col1),
+                )
+        self._blocks.append(block)
+        self._changes += 1
+        self._row = block.row + block.num_rows
+        self._col = block.col
+        if self.streaming:
+            self.flush_rows(self._row - self.stream_window)
+        return block
+
+    def fill_formula(
+        self, formula, row1=None, col1=None, row2=None, col2=None,
+        style=None, shared=True
+    ):
+        """Fill a range with a formula written for its top-left cell.
+
+        The formula is parsed once and its relative references move with
+        each cell as they would with Excel's fill down and fill right. With
+        shared, the range is written as one Excel shared formula, so the
+        formula text is stored once rather than in every cell.
+        """
+        row1 = row1 if row1 is not None else self._row
+        col1 = col1 if col1 is not None else self._col
+        row2 = row2 if row2 is not None else row1
+        col2 = col2 if col2 is not None else col1
+        self._check_row(row1)
+        si = None
+        if shared and (row2 > row1 or col2 > col1):
+            si = self._shared_formulas
+            self._shared_formulas += 1
+        block = FormulaBlock(
+            row1, col1, row2 - row1 + 1, col2 - col1 + 1,
+            FormulaTemplate(formula), self.get_style(style), si,
+        )
+        return self._add_block(block)
+
+    def fill_down(self, formula, num_rows, style=None, row=None, col=None,
+                  shared=True):
+        """Fill num_rows cells down from row, col with formula."""
+        row = row if row is not None else self._row
+        col = col if col is not None else self._col
+        return self.fill_formula(
+            formula, row, col, row + num_rows - 1, col, style, shared
+        )
+
+    def fill_right(self, formula, num_cols, style=None, row=None, col=None,
+                   shared=True):
+        """Fill num_cols cells right from row, col with formula."""
+        row = row if row is not None else self._row
+        col = col if col is not None else self._col
+        return self.fill_formula(
+            formula, row, col, row, col + num_cols - 1, style, shared
+        )
+
+    def merge_cells(
+        self, row1, col1, row2, col2, value=None, style=None, data_type=None
+    ):
+        """Merge a range into one cell showing value.
+
+        Cells already in the range are dropped; without a value the
+        top-left cell's value and style are kept. A value written later at
+        the top-left cell replaces the merge's value; ones written
+        elsewhere in the range are dropped. Raises OverlappingMergeError if
+        the range overlaps another merge.
+        """
+        row1, row2 = min(row1, row2), max(row1, row2)
+        col1, col2 = min(col1, col2), max(col1, col2)
+        if row1 == row2 and col1 == col2:
+            raise ValueError("A merged range needs more than one cell.")
+        self._check_row(row1)
+        other = self._merges.overlapping(row1, col1, row2, col2)
+        if other is not None:
+            other = xl_range(other.row1, other.col1, other.row2, other.col2)
+            raise errors.OverlappingMergeError(
+                f"{xl_range(row1, col1, row2, col2)} overlaps the merged "
+                f"range {other}."
+            )
+        anchor = self._cells.get(row1, col1)
+        if anchor is not None:
+            if value is None:
+                value, data_type = anchor.value, anchor.data_type
+            style = self.css.combine(anchor.style, self.get_style(style)) \
+                if style is not None else anchor.style
+        else:
+            style = self.get_style(style)
+            if len(self._overlays):
+                style = self._overlaid_style(row1, col1, style)
+        if type(value) is str:
+            strings = self._string_pool()
+            if strings is not None:
+                value = strings.intern(value)
+        self._cells.discard_range(row1, col1, row2, col2)
+        self._changes += 1
+        return self._merges.add(row1, col1, row2, col2, value, style, data_type)
+
+    def _write_merged(self, merge, row, col, value, style, data_type):
+        """Write a value inside a merged range.
+
+        A value at the top-left cell replaces the merge's value and its
+        style extends the merge's style, as cell() does for a cell already
+        written. Anywhere else in the range nothing is stored. Returns the
+        merge, or None if the value was dropped.
+        """
+        if (row, col) != (merge.row1, merge.col1):
+            return None
+        merge.value = value
+        merge.data_type = data_type
+        merge.style = self.css.combine(merge.style, style)
+        self._changes += 1
+        return merge
+
+    def get_merge(self, row, col):
+        """The merged range covering row, col, or None."""
+        return self._merges.find(row, col)
+
+    def write_frame(
+        self, frame, row=None, col=None, header=True, index=False,
+        header_style=None, index_style=None, col_styles=None
+    ):
+        """Write a pandas DataFrame or Arrow table as a block.
+
+        Each column's dtype is looked at once: numbers are written as
+        numbers, datetime64 columns as dates styled with frame_styles
+        (month starts as 'month') and text as strings. col_styles replaces
+        the frame_styles style of the data columns, either one style for
+        every column or a list with one entry per column. Column labels
+        are written above with header_style, and with index the index
+        levels come first, styled with index_style.
+        """
+        row = row if row is not None else self._row
+        col = col if col is not None else self._col
+        names, columns, num_index = frame_columns(frame, index)
+        styles = [index_style] * num_index + per_column(
+            col_styles, len(names) - num_index, "col_styles"
+        )
+        data_types = []
+        for j, column in enumerate(columns):
+            columns[j], kind = convert_column(column, self.date_1904)
+            data_types.append('str' if kind == 'str' else
+                              'number' if kind is not None else None)
+            if styles[j] is None:
+                styles[j] = self.frame_styles.get(kind)
+        if header:
+            header_style = self.get_style(header_style)
+            for j, name in enumerate(names):
+                self.cell(name, header_style, 'str', row=row, col=col + j)
+            row += 1
+        return self.write_block(
+            columns, row, col, data_types=data_types, orient="columns",
+            col_styles=styles,
+        )
 
     def xy(self, x_rel=0, y_rel=0, x_abs=False, y_abs=False, abs=False):
         location = xl_rowcol_to_cell(
@@ -178,40 +599,57 @@ class XlWorksheet(Worksheet):
         """Will replace any existing format."""
         if isinstance(style, str):
             style = self.css.get(style)
-        location = xl_rowcol_to_cell(row, col)
-        if location in self._cells:
-            self._cells[location].set_format(style)
+        elif style is not None:
+            style = self.css.intern(style)
+        self._check_row(row)
+        cell = self._cells.get(row, col)
+        if cell is not None:
+            cell.set_style(style)
         else:
-            self._cells[location] = Cell(row, col, style=style)
-        self.css.add(self._cells[location].style)
+            cell = self._cells.add(row, col, style=style)
 
     def format_cell(self, row, col, style):
         """Will extend any existing format."""
         #todo: allow A1 notation
         style = self.get_style(style)
-        location = xl_rowcol_to_cell(row, col)
-        if location in self._cells:
-            cell = self._cells[location]
-            existing_style = cell.style
-            if existing_style is None:
-                cell.style = style
-            else:
-                combined_style = existing_style + style
-                existing_combined_style = self.css.get(combined_style.name)
-                if existing_combined_style is None:
-                    cell.add_style(style)
-                else:
-                    cell.style = existing_combined_style
+        if row < self._flushed:
+            self._check_row(row)
+        cell = self._cells.get(row, col)
+        if cell is not None:
+            cell.style = self.css.combine(cell.style, style)
         else:
-            cell = Cell(row, col, style=style)
-            self._cells[location] = cell
-        self.css.add(cell.style, exists_ok=True)
+            if len(self._overlays):
+                style = self._overlaid_style(row, col, style)
+            cell = self._cells.add(row, col, style=style)
+
+    def _overlaid_style(self, row, col, style=None):
+        """style layered over the range overlays covering row, col.
+
+        Overlays applied before a block holding the cell are left out, as
+        they are layered under the block's style when it is written.
+        """
+        since = 0
+        for block in reversed(self._blocks):
+            if block.covers(row, col):
+                since = block.order
+                break
+        combined = None
+        for overlay in self._overlays.covering(row, col):
+            if overlay.order > since:
+                combined = self.css.combine(combined, overlay.style)
+        return self.css.combine(combined, style)
 
     def format_range(
         self, row1=None, col1=None, row2=None, col2=None, style=None
     ):
-        """row and col counts from 0. eg row1=2 is 3rd row of excel sheet."""
-        # style = self.get_style(style)
+        """row and col counts from 0. eg row1=2 is 3rd row of excel sheet.
+
+        The range is recorded as a single overlay rather than a cell per
+        position. Cells already in the range are extended now; cells
+        written later start from the overlay's style, and positions that
+        never get a cell are written as formatted blanks at build time.
+        """
+        style = self.get_style(style)
         if row1 is None:
             row1 = self._row
         if row2 is None:
@@ -220,9 +658,46 @@ class XlWorksheet(Worksheet):
             col1 = self._col
         if col2 is None:
             col2 = self._col
-        for x in range(row1, row2 + 1):
-            for y in range(col1, col2 + 1):
-                self.format_cell(x, y, style)
+        self._check_row(row1)
+        self._layers += 1
+        self._overlays.add(row1, col1, row2, col2, style, self._layers)
+        self._changes += 1
+        for cell in self._cells.iter_range(row1, col1, row2, col2):
+            cell.style = self.css.combine(cell.style, style)
+
+    def style_rule(
+        self, row1, col1, row2, col2, style, test, value=None, key_col=None,
+        vectorized=False, native=None,
+    ):
+        """Style the values in a range that pass a test.
+
+        See rules.StyleRule for the tests. Comparisons become Excel
+        conditional formats unless native is False; other rules are tested
+        a column at a time when the rows are built, and cells that pass
+        are extended with style as by format_cell(). Either way the cost
+        is per rule, not per cell written.
+        """
+        self._check_row(row1)
+        rule = StyleRule(
+            row1, col1, row2, col2, self.get_style(style), test, value,
+            key_col, vectorized, native,
+        )
+        self._rules.append(rule)
+        self._changes += 1
+        return rule
+
+    def column_rule(
+        self, col, style, test, value=None, first_row=None, last_col=None,
+        **options
+    ):
+        """style_rule() for columns col to last_col, from first_row (the
+        current row by default) to the last row of the sheet."""
+        if first_row is None:
+            first_row = self._row
+        last_col = col if last_col is None else last_col
+        return self.style_rule(
+            first_row, col, None, last_col, style, test, value, **options
+        )
 
     def get_style(self, style) -> Style:
         if isinstance(style, str):
@@ -230,7 +705,7 @@ class XlWorksheet(Worksheet):
         elif isinstance(style, (list, tuple)):
             style = self.css.combine_styles(style)
         elif isinstance(style, Style):
-            style = self.css.add(style, exists_ok=True)
+            style = self.css.intern(style)
         else:
             style = self.css.default
         # if isinstance(style, str):
@@ -250,23 +725,33 @@ class XlWorksheet(Worksheet):
 
     def vtotal(
         self, num_rows, style=None, dirn=-1,
-        ftype=0, row=None, col=None
+        ftype=0, row=None, col=None, num_cols=1
     ):
-        """dirn is direction up/down """
+        """dirn is direction up/down.
+
+        With num_cols the total is filled right across that many columns
+        with fill_formula() and the FormulaBlock is returned.
+        """
         if row is None:
             row = self._row
         if col is None:
             col = self._col
         rng = xl_range(row + num_rows * dirn, col, row + 1 * dirn, col)
         formula = self.total_formula(rng, ftype)
+        if num_cols > 1:
+            return self.fill_formula(
+                formula, row, col, row, col + num_cols - 1, style
+            )
         result = self.cell(formula, self.get_style(style),
             'formula', row=row, col=col)
         return result
 
     def htotal(
         self, num_cols, style=None, dirn=-1,
-        ftype=0, row=None, col=None
+        ftype=0, row=None, col=None, num_rows=1
     ):
+        """With num_rows the total is filled down that many rows with
+        fill_formula() and the FormulaBlock is returned."""
         if row is None:
             row = self._row
         if col is None:
@@ -275,18 +760,26 @@ class XlWorksheet(Worksheet):
         if num_cols > 0:
             rng = xl_range(row, col + num_cols * dirn, row, col + 1 * dirn)
             formula = self.total_formula(rng, ftype)
+        if num_rows > 1 and formula:
+            return self.fill_formula(
+                formula, row, col, row + num_rows - 1, col, style
+            )
         result = self.cell(
             formula, self.get_style(style),
             'formula', row=row, col=col
         )
         return result
 
-    def hvariance(self, c1_rel, c2_rel, style=None):
+    def hvariance(self, c1_rel, c2_rel, style=None, num_rows=1):
+        """With num_rows the variance is filled down that many rows with
+        fill_formula() and the FormulaBlock is returned."""
         row = self.y()
         c1 = self.x() + c1_rel
         c2 = self.x() + c2_rel
         a = xl_rowcol_to_cell(row, c1)
         b = xl_rowcol_to_cell(row, c2)
+        if num_rows > 1:
+            return self.fill_down(f"={a}-{b}", num_rows, style)
         return self.cell(f"={a}-{b}", self.get_style(style))
 
     def total_formula(self, range, ftype=0):
@@ -306,6 +799,8 @@ class XlWorksheet(Worksheet):
         return f"={sign}{a}*{b}"
 
     def vmult_formula(self, r1_rel, r2_rel, neg=False):
+        """The formula for the current cell; pass it to fill_right() to
+        fill a row with it."""
         return self.mult_formula(
             self._row + r1_rel,
             self._col,
@@ -338,8 +833,10 @@ class XlWorksheet(Worksheet):
         return formula
 
     def hdiv_formula(self, numer_x_rel, denom_x_rel, default=None):
-        """Divide two cells in the current row given two column positions 
+        """Divide two cells in the current row given two column positions
         relative to the current cell.
+
+        Pass the formula to fill_down() to fill a column with it.
         """
         return self.div_formula(
             self._row,
@@ -368,11 +865,15 @@ class XlWorksheet(Worksheet):
             formula = f"=IFERROR({numer}/{denom},{str(default)})"
         return self.cell(formula, style, 'formula')
 
-    def sumifs(self, sum_range, *criteria, style=None):
+    def sumifs(self, sum_range, *criteria, style=None, num_rows=1):
+        """With num_rows the formula is filled down that many rows with
+        fill_formula() and the FormulaBlock is returned."""
         formula = f'=SUMIFS({ sum_range }'
         for c in criteria:
             formula += f', { c[0] }, "{ c[1] }"'
         formula += ')'
+        if num_rows > 1:
+            return self.fill_down(formula, num_rows, style)
         return self.cell(formula, style, 'formula')
 
     # def get_cell(self, row, col):
@@ -380,72 +881,644 @@ class XlWorksheet(Worksheet):
     #     return self._cells.get(location, None)
 
     def build(self, workbook):
-        self.css.build(workbook)
-        for row in sorted(self._rows):
-            row.write(self)
-        for cell in sorted(self._cells.values()):
-            cell.write(self)
-        for rng in self._merged:
-            pass
+        self._write_row_range(workbook)
+
+    def add_built_rows(self, xml, state):
+        """Take the row XML and build_state a build worker made."""
+        self.row_data_fh.write(xml)
+        self.__dict__.update(state)
+
+    def flush_rows(self, upto=None):
+        """Write every row above upto to the workbook and release it.
+
+        Flushed rows can no longer be changed. With the workbook's
+        constant_memory option the rows go straight to xlsxwriter's row
+        writer, so memory is bounded by the rows not yet flushed. Returns
+        the new watermark: the first row that has not been written.
+        """
+        if upto is None:
+            upto = self._row
+        if self._workbook is None or upto <= self._flushed:
+            return self._flushed
+        self._write_row_range(self._workbook, upto)
+        self._flushed = upto
+        return self._flushed
+
+    def _string_pool(self):
+        """The workbook's StringPool, or None if strings aren't pooled.
+
+        The pool keeps every string it is given, so it is not used before
+        the sheet is added, by a streaming sheet or under a memory budget.
+        """
+        workbook = self._workbook
+        if self.streaming or getattr(workbook, 'memory_budget', None):
+            return None
+        return getattr(workbook, 'strings', None)
+
+    def _string_values(self):
+        """The values held in cells, blocks and merges, to find strings."""
+        for cell in self._cells:
+            yield cell.value
+        for block in self._blocks:
+            for column in block.columns:
+                if self._object_column(column):
+                    yield from column
+        for merge in self._merges:
+            yield merge.value
+
+    def _timer(self, name, workbook=None):
+        """Time a build phase of this sheet in the workbook's stats."""
+        stats = getattr(workbook or self._workbook, 'stats', None)
+        if stats is None:
+            return nullcontext()
+        return stats.timer(name, self.name)
+
+    def memory_usage(self):
+        """The cell store's memory report with counts of blocks,
+        overlays and merged ranges."""
+        usage = self._cells.memory_usage()
+        usage.update(
+            blocks=len(self._blocks), overlays=len(self._overlays),
+            merges=len(self._merges),
+        )
+        return usage
+
+    def _check_memory(self, store, row):
+        """Spill the oldest rows of the sheet when the workbook is over
+        its memory budget, down to its low water mark."""
+        workbook = self._workbook
+        budget = getattr(workbook, 'memory_budget', None)
+        if not budget:
+            return
+        used = workbook.memory_bytes()
+        if used <= budget:
+            return
+        cells = (used - budget * workbook.memory_low_water) // store.cell_bytes
+        spilled = store.spill(
+            cells, max(self._flushed, row - self.spill_window),
+            workbook.tmpdir,
+        )
+        if spilled:
+            workbook.stats.count('spilled_cells', spilled, self.name)
+
+    def add_rule_formats(self, workbook):
+        """Add the native style rules as conditional formats.
+
+        Called by XlWorkbook.build() once every row is written.
+        """
+        native = [rule for rule in self._rules if rule.native]
+        if not native or self.dim_rowmax is None:
+            return
+        for rule in native:
+            fmt = self.css.build_style(rule.style, workbook)
+            self.conditional_format(
+                *rule.conditional_format(fmt, self.dim_rowmax)
+            )
+        self._rules = [rule for rule in self._rules if not rule.native]
+
+    def _apply_rules(self, upto=None):
+        """Test the build time rules on rows from the watermark up to
+        upto and extend the style of the cells that pass.
+
+        Block values that pass are marked in the block's rule masks
+        rather than stored as cells.
+        """
+        last = (self.xls_rowmax if upto is None else upto) - 1
+        for rule in self._rules:
+            if rule.native:
+                continue
+            row1 = max(rule.row1, self._flushed)
+            row2 = last if rule.row2 is None else min(rule.row2, last)
+            if row1 > row2:
+                continue
+            cols = range(rule.col1, rule.col2 + 1)
+            if rule.key_col is None:
+                for col in cols:
+                    self._style_hits(
+                        self._rule_hits(rule, col, row1, row2), col,
+                        rule.style,
+                    )
+            else:
+                hits = self._rule_hits(rule, rule.key_col, row1, row2)
+                for col in cols:
+                    self._style_hits(hits, col, rule.style)
+        if upto is not None:
+            self._rules = [
+                rule for rule in self._rules if rule.native or
+                rule.row2 is None or rule.row2 >= upto
+            ]
+
+    def _style_hits(self, rows, col, style):
+        """Extend the style of rows of a column: cells are extended and
+        block values marked in the block, else a styled cell is added."""
+        blocks = [b for b in self._blocks if b.col <= col <= b.last_col]
+        block_rows = {}
+        for row in rows:
+            cell = self._cells.get(row, col)
+            if cell is not None:
+                cell.style = self.css.combine(cell.style, style)
+                continue
+            for block in reversed(blocks):
+                if block.row <= row <= block.last_row:
+                    block_rows.setdefault(block, []).append(row)
+                    break
+            else:
+                self.format_cell(row, col, style)
+        for block, hits in block_rows.items():
+            block.add_rule_hits(col, hits, style)
+
+    def _rule_hits(self, rule, col, row1, row2):
+        """Rows of one column whose values pass a rule's test.
+
+        Each block column is tested as one slice and the cells as one
+        list. Formulas are skipped, as their values aren't known.
+        """
+        rows, values, written = [], [], set()
+        for cell in self._cells.iter_range(row1, col, row2, col):
+            value = cell.value
+            if value is None:
+                continue  # a block value shows through
+            written.add(cell.row)
+            if cell.data_type != 'formula':
+                rows.append(cell.row)
+                values.append(value)
+        hits = rule.hits(rows, values) if rows else []
+        for block in self._blocks:
+            if not block.col <= col <= block.last_col or \
+                    block.get_type(col) == 'formula':
+                continue
+            column = block.columns[col - block.col]
+            first = max(row1, block.row)
+            last = min(row2, block.row + len(column) - 1)
+            if first > last:
+                continue
+            hits.extend(
+                row for row in rule.hits(
+                    range(first, last + 1),
+                    column[first - block.row:last - block.row + 1],
+                ) if row not in written
+            )
+        return hits
+
+    def _check_row(self, row):
+        if row < self._flushed:
+            raise errors.RowFlushedError(
+                f"Row {row} has already been written to {self.name}."
+            )
+
+    def _write_row_range(self, workbook, upto=None):
+        """Write rows, cells, blocks and overlays above upto in row order
+        and drop them from the sheet. With no upto everything is written
+        and kept.
+        """
+        def done(row):
+            return upto is None or row < upto
+
+        if self._rules:
+            with self._timer('rules', workbook):
+                self._apply_rules(upto)
+        with self._timer('sort', workbook):
+            rows = sorted(r for r in self._rows.values() if done(r.row))
+            blocks = sorted(b for b in self._blocks if done(b.row))
+            cell_rows = self._cells.rows(upto)
+        with self._timer('build_formats', workbook):
+            self._apply_col_styles(workbook)
+            for row in rows:
+                if row.style is not None:
+                    self.css.build_style(row.style, workbook)
+            self._cells.build_formats(self.css, workbook)
+            for block in blocks:
+                for style in block.styles:
+                    self.css.build_style(style, workbook)
+        with self._timer('write', workbook), self._cells.reading():
+            for row in rows:
+                row.write(self)
+            if blocks or len(self._overlays):
+                self._write_layered_rows(workbook, blocks, upto)
+            else:
+                compiled = self._cells.compile(self)
+                rows = cell_rows
+                if len(self._merges):
+                    rows = heapq.merge(rows, *self._merges.row_ranges(
+                        self._flushed, upto
+                    ))
+                previous = None
+                for row in rows:
+                    if row == previous:
+                        continue
+                    previous = row
+                    skip = None
+                    if len(self._merges):
+                        skip = self._write_merges(row, workbook)
+                    self._cells.write_row(
+                        self, row, skip, compiled,
+                        self._default_cell_formats(row, workbook),
+                    )
+        stats = getattr(workbook, 'stats', None)
+        if stats is not None:
+            cells = sum(self._cells.row_count(row) for row in cell_rows)
+            for block in blocks:
+                last = block.row + block.num_rows
+                if upto is not None:
+                    last = min(last, upto)
+                cells += (last - max(block.row, self._flushed)) * block.num_cols
+            stats.count('cells', cells, self.name)
+        if upto is not None:
+            self._rows = {
+                r: settings for r, settings in self._rows.items()
+                if not done(r)
+            }
+            self._cells.discard_rows(upto)
+            self._blocks = [b for b in self._blocks if not done(b.last_row)]
+            self._overlays.discard_rows(upto)
+            self._merges.discard_rows(upto)
+
+    def _write_layered_rows(self, workbook, blocks, upto=None):
+        """Write cells, blocks and range overlays together in row order.
+
+        A cell inside a block is layered on top of it: the cell's style
+        extends the block column's style and its value, if any, replaces
+        the block value. Overlays and block styles are layered in the order
+        they were added, and overlays are written as formatted blanks
+        where nothing else is.
+        """
+        store = self._cells
+        ranges = self._overlays.row_ranges(self._flushed, upto)
+        ranges += self._merges.row_ranges(self._flushed, upto)
+        for block in blocks:
+            last = block.row + block.num_rows
+            if upto is not None:
+                last = min(last, upto)
+            ranges.append(range(max(block.row, self._flushed), last))
+        active = []
+        i = 0
+        previous = None
+        for row in heapq.merge(store.rows(upto), *ranges):
+            if row == previous:
+                continue
+            previous = row
+            while i < len(blocks) and blocks[i].row <= row:
+                active.append(blocks[i])
+                i += 1
+            active = [b for b in active if b.last_row >= row]
+            cols = set(store.row_cols(row))
+            merged = self._write_merges(row, workbook) if len(self._merges) \
+                else None
+            if merged:
+                cols |= merged
+            row_style = self._row_style(row)
+            defaults = row_style is not None or self._col_styles
+            segments = [
+                (start, stop, overlays, self._combine_all(overlays))
+                for start, stop, overlays in self._overlays.segments(row)
+            ]
+            for block in active:
+                formats = None
+                hits = block.rule_styles(row)
+                if segments or defaults or hits:
+                    formats = self._block_formats(
+                        block, segments, workbook, row_style, hits
+                    )
+                block.write_row(self, row, cols, formats)
+            for start, stop, _, style in segments:
+                fmt = self.css.build_style(style, workbook)
+                for col in range(start, stop):
+                    if col in cols or any(
+                        b.col <= col <= b.last_col for b in active
+                    ):
+                        continue
+                    if defaults:
+                        fmt = self._layered_format(
+                            row_style, col, style, workbook
+                        )
+                        if fmt is None:
+                            continue  # the row or column format shows
+                    self.write_blank(row, col, '', fmt)
+            for cell in store.iter_row(row):
+                if merged and cell.col in merged:
+                    continue
+                for block in active:
+                    if block.col <= cell.col <= block.last_col:
+                        self._write_over_block(
+                            cell, block, workbook, row_style
+                        )
+                        break
+                else:
+                    if defaults:
+                        write_cell(
+                            self, row, cell.col, cell.value, cell.data_type,
+                            self._layered_format(
+                                row_style, cell.col, cell.style, workbook
+                            ),
+                            **cell.kwargs
+                        )
+                    else:
+                        cell.write(self)
+
+    def _write_merges(self, row, workbook):
+        """Write the cells of merged ranges in row and return their
+        columns, or None if no merge covers the row.
+
+        Every cell of a merge gets its format; the top-left one also
+        holds the value and records the range for <mergeCells>.
+        """
+        merges = self._merges.row(row)
+        if not merges:
+            return None
+        covered = set()
+        for merge in merges:
+            if merge.format is None:
+                # One format for the whole range, even where it is the
+                # row or column default.
+                row_style = self._row_style(merge.row1)
+                merge.format = self._layered_format(
+                    row_style, merge.col1, merge.style, workbook
+                )
+                fallback = row_style if row_style is not None \
+                    else self._col_styles.get(merge.col1)
+                if merge.format is None and fallback is not None:
+                    merge.format = self.css.build_style(fallback, workbook)
+            first = merge.col1
+            if row == merge.row1:
+                write_cell(
+                    self, row, first, merge.value, merge.data_type,
+                    merge.format,
+                )
+                self.merge.append(
+                    [merge.row1, merge.col1, merge.row2, merge.col2]
+                )
+                first += 1
+            for col in range(first, merge.col2 + 1):
+                self._write_blank(row, col, '', merge.format)
+            covered.update(range(merge.col1, merge.col2 + 1))
+        return covered
+
+    def _combine_all(self, overlays):
+        combined = None
+        for overlay in overlays:
+            combined = self.css.combine(combined, overlay.style)
+        return combined
+
+    def _layered_block_style(self, block, col, overlays):
+        """The style of a block column and overlays, layered in the order
+        they were added."""
+        style = None
+        placed = False
+        for overlay in overlays:
+            if not placed and overlay.order > block.order:
+                style = self.css.combine(style, block.get_style(col))
+                placed = True
+            style = self.css.combine(style, overlay.style)
+        if not placed:
+            style = self.css.combine(style, block.get_style(col))
+        return style
+
+    def _block_formats(
+        self, block, segments, workbook, row_style=None, hits=None
+    ):
+        """Formats for the block columns that range overlays, row and
+        column defaults or rule hits (column: rule styles) cover."""
+        styles = {}
+        for start, stop, overlays, _ in segments:
+            for col in range(max(start, block.col), min(stop, block.last_col + 1)):
+                styles[col] = self._layered_block_style(block, col, overlays)
+        if row_style is not None:
+            cols = range(block.col, block.last_col + 1)
+        else:
+            cols = [c for c in self._col_styles if block.covers(block.row, c)]
+        for col in cols:
+            styles.setdefault(col, block.get_style(col))
+        for col, rule_styles in (hits or {}).items():
+            style = styles.get(col, block.get_style(col))
+            for rule_style in rule_styles:
+                style = self.css.combine(style, rule_style)
+            styles[col] = style
+        return {
+            col: self._layered_format(row_style, col, style, workbook)
+            for col, style in styles.items()
+        }
+
+    def _write_over_block(self, cell, block, workbook, row_style=None):
+        value, data_type = cell.value, cell.data_type
+        if value is None:
+            value = block.get_value(cell.row, cell.col)
+            data_type = block.get_type(cell.col)
+        # The cell's style already holds the overlays added after the block.
+        older = [
+            overlay for overlay in self._overlays.covering(cell.row, cell.col)
+            if overlay.order < block.order
+        ]
+        style = self.css.combine(
+            self._layered_block_style(block, cell.col, older), cell.style
+        )
+        fmt = self._layered_format(row_style, cell.col, style, workbook)
+        write_cell(
+            self, cell.row, cell.col, value, data_type, fmt, **cell.kwargs
+        )
+
+    def _write_shared_formula(self, row, col, cell):
+        # Store a SharedFormula cell, as _write_formula() stores a formula.
+        if self._check_dimensions(row, col):
+            return -1
+        if self.constant_memory and row > self.previous_row:
+            self._write_single_row(row)
+        self.table[row][col] = cell
+        return 0
+
+    def _write_cell(self, row, col, cell):
+        if type(cell) is not SharedFormula:
+            return super()._write_cell(row, col, cell)
+        attributes = ' r="%s"' % xl_rowcol_to_cell_fast(row, col)
+        fmt = cell.format
+        if not fmt and row in self.set_rows and self.set_rows[row][1]:
+            fmt = self.set_rows[row][1]
+        elif not fmt and col in self.col_formats:
+            fmt = self.col_formats[col]
+        if fmt:
+            attributes += ' s="%d"' % fmt._get_xf_index()
+        if cell.formula is None:
+            self.fh.write('<c%s><f t="shared" si="%d"/><v>%s</v></c>' % (
+                attributes, cell.si, cell.value
+            ))
+        else:
+            self.fh.write(
+                '<c%s><f t="shared" ref="%s" si="%d">%s</f><v>%s</v></c>' % (
+                    attributes, cell.ref, cell.si,
+                    self._escape_data(cell.formula), cell.value
+                )
+            )
 
     def print_cells(self):
         print(f"Cells for Worksheet {self.name}:")
-        for loc in sorted(self._cells):
-            print(loc + ': ' + str(self._cells[loc]))
+        for cell in self._cells:
+            loc = xl_rowcol_to_cell(cell.row, cell.col)
+            print(loc + ': ' + str(cell))
 
     def row_style(self, height=14.25, style=None, options=None, row=None):
+        """Set the height and default style of a row.
+
+        The style is written once with set_row() and empty cells in the
+        row show it. A cell with a style of its own shows only that style,
+        unless layer_row_styles is set: then the cell's style extends the
+        row's. Calling again for the same row replaces its settings.
+        """
         if row is None:
             row = self._row
             # self.next_row()
-        if isinstance(style, str):
-            style = self.css.get(style)
-        if style is None:
-            style = self.css._default
-        self._rows.append(Row(row, height, style, options))
+        if style is not None:
+            style = self.get_style(style)
+        self._check_row(row)
+        self._rows[row] = Row(row, height, style, options)
+        self._changes += 1
 
-    def col_style(self):
-        #todo
-        pass
+    def col_style(
+        self, style, first_col=None, last_col=None, width=None, options=None
+    ):
+        """Set the default style of columns first_col to last_col.
+
+        The style is written once with set_column(), like a row_style().
+        Cells in the columns are layered over it and need no format of
+        their own when they add nothing to it. A width set earlier with
+        set_column() is kept unless width is given.
+        """
+        first_col = first_col if first_col is not None else self._col
+        last_col = last_col if last_col is not None else first_col
+        style = self.get_style(style)
+        for col in range(first_col, last_col + 1):
+            self._col_styles[col] = style
+        self._col_ranges.append((first_col, last_col, style, width, options))
+        self._changes += 1
+
+    def _row_style(self, row):
+        settings = self._rows.get(row)
+        return settings.style if settings is not None else None
+
+    def _apply_col_styles(self, workbook):
+        """Send column styles to set_column() before rows are written.
+
+        Columns set earlier with set_column() keep their width and options
+        unless col_style() was given its own.
+        """
+        for first_col, last_col, style, width, options in self._col_ranges:
+            fmt = self.css.build_style(style, workbook)
+            for first, last, info in self._split_colinfo(first_col, last_col):
+                col_width, col_options = width, options
+                if info is not None:
+                    if col_width is None:
+                        col_width = info[2]
+                    if col_options is None:
+                        col_options = {
+                            'hidden': info[4], 'level': info[5],
+                            'collapsed': info[6],
+                        }
+                self.set_column(first, last, col_width, fmt, col_options)
+        self._col_ranges = []
+
+    def _split_colinfo(self, first_col, last_col):
+        """Cut first_col to last_col out of the set_column() ranges.
+
+        The parts of a range outside the columns are kept, so no <col>
+        elements overlap. Returns (first, last, info) for the columns in
+        order, where info is the settings of the range that covered them,
+        or None.
+        """
+        segments = []
+        col = first_col
+        for key, info in sorted(self.colinfo.items()):
+            first, last = info[0], info[1]
+            if last < first_col or first > last_col:
+                continue
+            del self.colinfo[key]
+            if first < first_col:
+                self.colinfo["%05d" % first] = (
+                    [first, first_col - 1] + info[2:]
+                )
+            if last > last_col:
+                self.colinfo["%05d" % (last_col + 1)] = (
+                    [last_col + 1, last] + info[2:]
+                )
+            first, last = max(first, first_col), min(last, last_col)
+            if first > col:
+                segments.append((col, first - 1, None))
+            segments.append((first, last, info))
+            col = last + 1
+        if col <= last_col:
+            segments.append((col, last_col, None))
+        return segments
+
+    def _default_cell_formats(self, row, workbook):
+        """Formats of the cells in row that row or column defaults cover."""
+        row_style = self._row_style(row)
+        if row_style is None and not self._col_styles:
+            return None
+        formats = {}
+        for cell in self._cells.iter_row(row):
+            if row_style is not None or cell.col in self._col_styles:
+                formats[cell.col] = self._layered_format(
+                    row_style, cell.col, cell.style, workbook
+                )
+        return formats
+
+    def _layered_format(self, row_style, col, style, workbook):
+        """Format for style layered over the row and column defaults.
+
+        None when that is the format xlsxwriter gives cells without one
+        (the row's, else the column's), so the cell needs no format.
+        Without layer_row_styles the row style is only that fallback.
+        """
+        col_style = self._col_styles.get(col)
+        fallback = row_style if row_style is not None else col_style
+        if row_style is not None and not self.layer_row_styles:
+            if style is None:
+                return None  # the row's format shows
+            row_style = None
+        if row_style is None and col_style is None:
+            return None if style is None else \
+                self.css.build_style(style, workbook)
+        key = (id(row_style), id(fallback), col, id(style))
+        cached = self._default_formats.get(key)
+        if cached is not None:
+            return cached[3]
+        base = self.css.combine(col_style, row_style)
+        layered = base
+        if style is not None and style is not self.css.default:
+            layered = self.css.combine(base, style)
+        fmt = self.css.build_style(layered, workbook)
+        if fmt is self.css.build_style(fallback, workbook):
+            fmt = None
+        # The styles are kept so their ids stay unique.
+        self._default_formats[key] = (row_style, fallback, style, fmt)
+        return fmt
 
     def box(
         self, row_1, col_1, row_2, col_2, border_style=1,
         border_color='black', pattern=0, bg_color=0, fg_color=0
     ):
-        """Makes an RxC box. Use integers, not the 'A1' format"""
-        rows = row_2 - row_1 + 1
-        cols = col_2 - col_1 + 1
-        num = self.css._boxes
-        self.css._boxes += 1
-
-        for x in range((rows) * (cols)):  # Total cells in the rectangle
-            properties = {}   # The format resets each loop
-            name = str(num) + '_'
-            row = row_1 + (x // cols)
-            column = col_1 + (x % cols)
-
-            if x < (cols):                     # If it's on the top row
-                properties['top'] = border_style
-                name += 't'
-            if x >= ((rows * cols) - cols):    # If it's on the bottom row
-                properties['bottom'] = border_style
-                name += 'b'
-            if x % cols == 0:                  # If it's on the left column
-                properties['left'] = border_style
-                name += 'l'
-            if x % cols == (cols - 1):         # If it's on the right column
-                properties['right'] = border_style
-                name += 'r'
-
-            if pattern:
-                properties['pattern'] = pattern
-            if bg_color:
-                properties['bg_color'] = bg_color
-            if fg_color:
-                properties['fg_color'] = fg_color
-            if properties != {}:
-                if border_color:
-                    properties['border_color'] = border_color
-                self.format_cell(row, column, Style(name, properties))
+        """Makes an RxC box. Use integers, not the 'A1' format.
+
+        The box is drawn as at most nine range overlays (four corners,
+        four edges and the interior, which is only formatted when there is
+        a fill), so its cost does not depend on its area.
+        """
+        def bands(first, last, low, high):
+            if first == last:
+                return [(first, last, low + high)]
+            result = [(first, first, low)]
+            if last - first > 1:
+                result.append((first + 1, last - 1, ''))
+            result.append((last, last, high))
+            return result
+
+        filled = pattern or bg_color or fg_color
+        for r1, r2, row_sides in bands(row_1, row_2, 't', 'b'):
+            for c1, c2, col_sides in bands(col_1, col_2, 'l', 'r'):
+                sides = row_sides + col_sides
+                if sides or filled:
+                    style = self.css.box_style(
+                        sides, border_style, border_color,
+                        pattern, bg_color, fg_color
+                    )
+                    self.format_range(r1, c1, r2, c2, style)
 
     def set_col_width(self, width=None, options={}, num_columns=1):
         self.set_column(